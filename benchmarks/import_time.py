@@ -0,0 +1,79 @@
+"""Import time budget of map_generator.
+
+Imports map_generator in fresh interpreters with -X importtime and checks what it costs on top of numpy, which no
+world can be generated without, against a budget. Rendering dependencies must not be imported at all. Exits with
+status 1 when either check fails.
+
+    python benchmarks/import_time.py [--budget-ms 20] [--runs 7]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+
+repo_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+import_budget_ms = 20  # map_generator import time on top of numpy
+lazy_modules = ("matplotlib",)  # must only be imported when an image is requested
+
+
+def measure_import(module):
+    """Cumulative import time in microseconds of every module imported by importing numpy, then module, in a fresh
+    interpreter, and the names of all modules loaded afterwards. Importing numpy first keeps the standard library
+    modules both need on its account."""
+    env = dict(os.environ)
+    # Like in production, imports read cached bytecode rather than compiling the source every time
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-X",
+            "importtime",
+            "-c",
+            f"import sys, numpy, {module}; print(*sys.modules)",
+        ],
+        cwd=repo_root,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        fields = line.removeprefix("import time:").split("|")
+        if (len(fields) == 3) & fields[1].strip().isdigit():
+            times[fields[2].strip()] = int(fields[1])
+    return times, set(result.stdout.split())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--budget-ms", type=float, default=import_budget_ms)
+    parser.add_argument("--runs", type=int, default=7)
+    args = parser.parse_args()
+
+    measure_import("map_generator")  # warm the bytecode cache
+    totals = []
+    overheads = []
+    for _ in range(args.runs):
+        times, loaded = measure_import("map_generator")
+        totals.append((times["numpy"] + times["map_generator"]) / 1000)
+        overheads.append(times["map_generator"] / 1000)
+    total = statistics.median(totals)
+    overhead = statistics.median(overheads)
+    eager = [name for name in lazy_modules if name in loaded]
+
+    print(f"import map_generator: {total:.1f} ms, {overhead:.1f} ms on top of numpy")
+    print(f"budget: {args.budget_ms:.1f} ms on top of numpy")
+    failed = overhead > args.budget_ms
+    if failed:
+        print("over budget")
+    if eager:
+        print(f"imported eagerly: {', '.join(eager)}")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
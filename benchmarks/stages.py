@@ -0,0 +1,178 @@
+"""Benchmark of each generation stage across map sizes and densities.
+
+Runs the stages of generate_world one after another on a shared TerrainIndex, as generate_world does, then renders
+the result. Every stage is timed at every size, density preset and seed, and runs once more under tracemalloc for its
+peak memory. Results are printed as a table and can be written as JSON for comparing commits.
+
+    python benchmarks/stages.py [--sizes 100 250 500 1000] [--densities default sparse dense] [--seeds 0 1]
+                                [--output results.json]
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import map_generator
+from map_generator import SAND, TerrainIndex, default_config
+
+# Tuning changed from the defaults by each density preset
+density_presets = {
+    "default": {},
+    "sparse": dict(
+        sinkhole_density=200, swamp_density=500, bc_nest_density=6, sc_nest_density=6
+    ),
+    "dense": dict(
+        sinkhole_density=600, swamp_density=800, bc_nest_density=9, sc_nest_density=9
+    ),
+}
+stage_names = (
+    "create_sinkholes",
+    "create_swamps",
+    "create_nests",
+    "starve_nests",
+    "starve_nests_batch",
+    "generate_image",
+)
+
+
+def run_stages(width, height, config, seed, measure):
+    """Run every stage on a fresh map, returning what measure(stage_name, call) gives for each"""
+    rng = random.Random(seed)
+    terrain_map = np.full((height, width), SAND, dtype=np.uint8)
+    index = TerrainIndex(terrain_map)
+    results = {}
+    for name in ("create_sinkholes", "create_swamps", "create_nests"):
+        stage = getattr(map_generator, name)
+        results[name] = measure(name, lambda: stage(terrain_map, index, config, rng))
+    # Both starving passes start from the same nests
+    results["starve_nests"] = measure(
+        "starve_nests",
+        lambda: map_generator.starve_nests(terrain_map.copy(), config=config),
+    )
+    results["starve_nests_batch"] = measure(
+        "starve_nests_batch",
+        lambda: map_generator.starve_nests_batch(terrain_map, config=config),
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "world.png")
+        results["generate_image"] = measure(
+            "generate_image", lambda: map_generator.generate_image(terrain_map, path)
+        )
+    return results
+
+
+def timed(name, call):
+    """Wall time of a call in seconds"""
+    start = time.perf_counter()
+    call()
+    return time.perf_counter() - start
+
+
+def traced(name, call):
+    """Peak bytes allocated during a call"""
+    tracemalloc.start()
+    try:
+        call()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark(sizes, densities, seeds, measure_memory=True):
+    """One result record per stage, size, density preset and seed"""
+    records = []
+    for size in sizes:
+        for density in densities:
+            config = dataclasses.replace(default_config, **density_presets[density])
+            for seed in seeds:
+                seconds = run_stages(size, size, config, seed, timed)
+                if measure_memory:
+                    peak_bytes = run_stages(size, size, config, seed, traced)
+                for name in stage_names:
+                    records.append(
+                        {
+                            "stage": name,
+                            "size": size,
+                            "tiles": size * size,
+                            "density": density,
+                            "seed": seed,
+                            "seconds": seconds[name],
+                            "ns_per_tile": seconds[name] * 1e9 / (size * size),
+                            "peak_bytes": (
+                                peak_bytes[name] if measure_memory else None
+                            ),
+                        }
+                    )
+                    print_record(records[-1])
+    return records
+
+
+def print_record(record):
+    """One line of the results table"""
+    peak = record["peak_bytes"]
+    memory = "" if peak is None else f"{peak / 2**20:9.1f} MiB"
+    print(
+        f"{record['stage']:<20} {record['size']:>5}² {record['density']:<8} seed {record['seed']:<3}"
+        f"{record['seconds'] * 1000:10.1f} ms {record['ns_per_tile']:9.0f} ns/tile {memory}"
+    )
+
+
+def environment():
+    """What the results were measured on"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "generator_version": map_generator.generator_version,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 250, 500, 1000])
+    parser.add_argument(
+        "--densities",
+        nargs="+",
+        choices=list(density_presets),
+        default=list(density_presets),
+    )
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0])
+    parser.add_argument(
+        "--no-memory", action="store_true", help="skip the tracemalloc pass"
+    )
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    records = benchmark(args.sizes, args.densities, args.seeds, not args.no_memory)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(
+                {"environment": environment(), "results": records}, file, indent=1
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Parameter sweeps: generate many worlds across a process pool and keep only their summary statistics."""
+
+import dataclasses
+import itertools
+import random
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from map_generator import (
+    NEST_BC,
+    NEST_STARVED_BC,
+    GenerationConfig,
+    Terrain,
+    default_config,
+    generate_world,
+)
+
+
+def run_ensemble(
+    parameter_grid, seeds, width=100, height=100, workers=None, config=default_config
+):
+    """Generate a world for every combination of the tuning values in parameter_grid, a dict from GenerationConfig
+    field name to the values to try, and every seed, starting from config. Returns a numpy structured array with a
+    row per world: the parameter values and seed, then the summary_stats of the world.
+    """
+    names = list(parameter_grid)
+    tunable = {field.name for field in dataclasses.fields(GenerationConfig)}
+    for name in names:
+        if name not in tunable:
+            raise ValueError(f"{name} is not a GenerationConfig field")
+    # Configs are checked here, before any work is fanned out
+    tasks = [
+        (dataclasses.replace(config, **dict(zip(names, values))), seed, width, height)
+        for values in itertools.product(*(parameter_grid[name] for name in names))
+        for seed in seeds
+    ]
+    # Worlds only come back as their stats, so memory stays flat however many there are
+    with ProcessPoolExecutor(workers) as pool:
+        stats = list(
+            pool.map(generate_stats, tasks, chunksize=max(len(tasks) // 64, 1))
+        )
+
+    rows = [
+        tuple(getattr(task_config, name) for name in names) + (seed,) + world_stats
+        for (task_config, seed, _, _), world_stats in zip(tasks, stats)
+    ]
+    dtype = [(name, np.int64) for name in names + ["seed"]] + stat_fields()
+    return np.array(rows, dtype=dtype)
+
+
+def generate_stats(task):
+    """Worker side of run_ensemble: generate one world with the given config and seed, and summarize it"""
+    config, seed, width, height = task
+    terrain_map = generate_world(width, height, config=config, rng=random.Random(seed))
+    return summary_stats(terrain_map)
+
+
+def stat_fields():
+    """Names and dtypes of the summary_stats columns"""
+    return [(terrain.name.lower(), np.int64) for terrain in Terrain] + [
+        ("starved_bc_ratio", np.float64)
+    ]
+
+
+def summary_stats(terrain_map):
+    """Tile count per terrain class, and the share of BC nest tiles that starved. Sinkholes are counted by the
+    hole_core column, a core tile each."""
+    counts = np.bincount(terrain_map.ravel(), minlength=len(Terrain)).tolist()
+    bc_tiles = counts[NEST_BC] + counts[NEST_STARVED_BC]
+    starved_bc_ratio = counts[NEST_STARVED_BC] / bc_tiles if bc_tiles else 0.0
+    return tuple(counts) + (starved_bc_ratio,)
@@ -0,0 +1,357 @@
+"""Serve whole Corrinthea worlds over HTTP to many clients at once, from one asyncio process.
+
+Worlds are generated on a process pool with as many jobs running as it has workers, and returned from memory as
+PNG images or world_format files, so concurrent requests never share an output file. Requests for a world that is
+already being generated, with the same seed, size, config and output, wait for that job rather than starting
+another. When more jobs are waiting for a worker than max_queued, new ones are turned away with 503 at once, and a
+job that has not finished timeout seconds after it was asked for answers 504.
+
+    python generation_service.py --port 8001
+
+serves http://localhost:8001/world.png?seed=7&width=200&height=100&scale=2 and /world.bin with the same
+parameters, any GenerationConfig field included, e.g. &swamp_density=800. --unix PATH listens on a Unix socket
+instead.
+"""
+
+import argparse
+import asyncio
+import io
+import multiprocessing
+import os
+import random
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, replace
+from urllib.parse import parse_qsl, urlsplit
+
+from map_generator import default_config, encode_png, generate_world
+from world_cache import entry_key
+from world_format import save_world
+
+max_side = 4096  # largest width or height served
+max_scale = 16
+max_image_side = 8192  # largest width or height of an image, in pixels
+# Most swamp spiral steps a world may have, see swamp_steps
+max_swamp_steps = 32 * 2**20
+job_timeout = 60.0  # seconds from a job being asked for to its result
+max_queued = 64  # jobs waiting for a worker before new ones are turned away
+
+# Output kinds by request path, with their content type
+outputs = {
+    "/world.png": ("png", "image/png"),
+    "/world.bin": ("world", "application/octet-stream"),
+}
+
+# Values a request may give each config field: every value the generator takes, short of those that make worlds
+# too slow or too large to serve
+config_ranges = {
+    "sinkhole_density": (0, 1000),
+    "sinkhole_min_dist": (0, 256),
+    "swamp_density": (0, 1000),
+    "swamp_avg_size": (0, 64),
+    "sc_nest_density": (0, 10),
+    "sc_nest_max_hole_dist": (0, 256),
+    "sc_nest_max_swamp_dist": (0, 64),
+    "sinkhole_avg_size": (0, 64),
+    "sinkhole_size_deviation": (0, 64),
+    "bc_nest_density": (0, 10),
+    "bc_nest_max_dist": (0, 256),
+    "bc_check_radius": (0, 256),
+    "bc_load": (0, 10000),
+    "bc_max_nest_size": (0, 64),
+    "sc_check_radius": (0, 256),
+    "bc_starve_range": (0, 256),
+    "sc_feed_multiplier": (0, 1000),
+    "swamp_min_size": (0, 64),
+    "swamp_max_size": (0, 64),
+    "swamp_min_arm": (0, 64),
+    "swamp_max_arm": (0, 64),
+    "swamp_max_bonus": (1, 64),
+}
+
+
+class ServiceBusy(Exception):
+    """Raised when a new job would make more than max_queued jobs wait for a worker"""
+
+
+@dataclass
+class ServiceStats:
+    requests: int = 0
+    jobs: int = 0
+    coalesced: int = 0  # requests answered by a job another request started
+    rejected: int = 0
+    timeouts: int = 0
+    pool_restarts: int = 0  # times a worker died and the pool was replaced
+
+
+def render_job(task):
+    """Generate a world in a worker process, returning it as PNG bytes for kind "png" or world file bytes for
+    kind "world"."""
+    kind, seed, width, height, config, scale = task
+    terrain_map = generate_world(width, height, config=config, rng=random.Random(seed))
+    if kind == "png":
+        return encode_png(terrain_map, scale)
+    buffer = io.BytesIO()
+    save_world(buffer, terrain_map, seed, config)
+    return buffer.getvalue()
+
+
+def worker_pool(workers):
+    """A process pool for render_job. Forked workers would keep the client connections open at the time they
+    start, so they are spawned."""
+    return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+
+
+class GenerationService:
+    """Runs render_job on a process pool for asyncio callers, sharing jobs between identical requests. Must be
+    used from one event loop."""
+
+    def __init__(self, workers=None, max_queued=max_queued, timeout=job_timeout):
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = worker_pool(self.workers)
+        self.slots = asyncio.Semaphore(
+            self.workers
+        )  # one per worker of the current pool
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.active = 0  # jobs on a worker or waiting for one
+        self.jobs = {}  # running or queued jobs by request key
+        self.stats = ServiceStats()
+
+    async def render(self, kind, seed, width, height, config=default_config, scale=1):
+        """PNG or world file bytes of a world, see render_job. Raises ServiceBusy when the queue is full and
+        TimeoutError when the job takes longer than timeout."""
+        self.stats.requests += 1
+        key = (kind, entry_key(seed, width, height, config), scale)
+        job = self.jobs.get(key)
+        if job is None:
+            # Counted from here rather than once the job starts, so a burst of requests can't all get in. Jobs
+            # beyond one per worker wait
+            if self.active >= self.workers + self.max_queued:
+                self.stats.rejected += 1
+                raise ServiceBusy(
+                    f"{self.active - self.workers} jobs are waiting for a worker"
+                )
+            self.active += 1
+            job = asyncio.ensure_future(
+                self.run((kind, seed, width, height, config, scale))
+            )
+            self.jobs[key] = job
+            job.add_done_callback(lambda _: self.jobs.pop(key, None))
+            self.stats.jobs += 1
+        else:
+            self.stats.coalesced += 1
+        # A client going away does not cancel the job others wait on
+        return await asyncio.shield(job)
+
+    async def run(self, task):
+        """Wait for a free worker and run a task on it, within the timeout. A worker that dies breaks the pool and
+        fails every job on it, and the first of those to fail replaces the pool for the jobs after them.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            async with asyncio.timeout(self.timeout):
+                try:
+                    slots = await self.acquire_slot()
+                except BaseException:
+                    self.active -= 1
+                    raise
+                pool = self.pool
+                try:
+                    future = loop.run_in_executor(pool, render_job, task)
+                except BaseException:
+                    self.release_slot(slots)
+                    raise
+                # A worker can't be stopped mid job, so its slot is only freed once it is done, timed out or not,
+                # and the pool never has more jobs than workers
+                future.add_done_callback(lambda _: self.release_slot(slots))
+                return await asyncio.shield(future)
+        except TimeoutError:
+            self.stats.timeouts += 1
+            raise
+        except BrokenProcessPool:
+            if pool is self.pool:
+                self.restart_pool()
+            raise
+
+    async def acquire_slot(self):
+        """Wait for a slot of the current pool and return the semaphore it was taken from"""
+        while True:
+            slots = self.slots
+            await slots.acquire()
+            if slots is self.slots:
+                return slots
+            # The pool was replaced while this job waited
+            slots.release()
+
+    def release_slot(self, slots):
+        self.active -= 1
+        slots.release()
+
+    def restart_pool(self):
+        """Replace a broken pool with a new one, whose workers are all free"""
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pool = worker_pool(self.workers)
+        self.slots = asyncio.Semaphore(self.workers)
+        self.stats.pool_restarts += 1
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+
+
+def parse_query(query):
+    """seed, width, height, scale and config of a request query string. Raises ValueError on a bad value or an
+    unknown parameter."""
+    params = dict(parse_qsl(query, strict_parsing=bool(query)))
+    values = {}
+    for name, value in params.items():
+        if (name not in config_ranges) & (
+            name not in ("seed", "width", "height", "scale")
+        ):
+            raise ValueError(f"unknown parameter {name}")
+        try:
+            values[name] = int(value)
+        except ValueError:
+            raise ValueError(f"{name} must be an int") from None
+    seed = values.pop("seed", 0)
+    width = values.pop("width", 100)
+    height = values.pop("height", 100)
+    scale = values.pop("scale", 1)
+    if not (0 < width <= max_side) & (0 < height <= max_side):
+        raise ValueError(f"width and height must be 1 to {max_side}")
+    if not 0 < scale <= max_scale:
+        raise ValueError(f"scale must be 1 to {max_scale}")
+    if max(width, height) * scale > max_image_side:
+        raise ValueError(f"images can be at most {max_image_side} pixels a side")
+    for name, value in values.items():
+        low, high = config_ranges[name]
+        if not low <= value <= high:
+            raise ValueError(f"{name} must be {low} to {high}")
+    config = replace(default_config, **values) if values else default_config
+    if config.swamp_min_size > config.swamp_max_size:
+        raise ValueError("swamp_min_size must be at most swamp_max_size")
+    if config.swamp_min_arm > config.swamp_max_arm:
+        raise ValueError("swamp_min_arm must be at most swamp_max_arm")
+    if swamp_steps(width, height, config) > max_swamp_steps:
+        raise ValueError(
+            "swamps would be too large, lower swamp_density, swamp_max_size or swamp_max_arm"
+        )
+    return seed, width, height, scale, config
+
+
+def swamp_steps(width, height, config):
+    """How many steps the swamp spirals of a world could take at most, going by the expected number of swamp seeds.
+    The spirals are all drawn at once, so this is what the memory the swamp stage needs grows with.
+    """
+    roll_range = 1001 - config.swamp_density
+    if roll_range <= 2:  # seeds roll a 2, which never comes up
+        return 0
+    seeds = width * height / roll_range
+    loops = config.swamp_max_size * max(config.swamp_max_bonus, 8)
+    return seeds * loops * 4 * config.swamp_max_arm
+
+
+def http_response(status, reason, body=b"", content_type="text/plain", headers=()):
+    """Bytes of an HTTP/1.1 response that closes the connection"""
+    lines = [
+        f"HTTP/1.1 {status} {reason}",
+        f"Content-Type: {content_type}",
+        f"Content-Length: {len(body)}",
+        "Connection: close",
+        *headers,
+    ]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode() + body
+
+
+async def respond(service, request_line):
+    """The response to the request line of a GET request"""
+    try:
+        method, target, _ = request_line.decode("latin-1").split()
+    except ValueError:
+        return http_response(400, "Bad Request")
+    if method != "GET":
+        return http_response(405, "Method Not Allowed", headers=["Allow: GET"])
+    url = urlsplit(target)
+    if url.path not in outputs:
+        return http_response(404, "Not Found")
+    kind, content_type = outputs[url.path]
+    try:
+        seed, width, height, scale, config = parse_query(url.query)
+    except ValueError as error:
+        return http_response(400, "Bad Request", str(error).encode())
+    try:
+        body = await service.render(kind, seed, width, height, config, scale)
+    except ServiceBusy as error:
+        return http_response(
+            503, "Service Unavailable", str(error).encode(), headers=["Retry-After: 1"]
+        )
+    except TimeoutError:
+        return http_response(504, "Gateway Timeout")
+    except Exception as error:
+        return http_response(
+            500, "Internal Server Error", f"{type(error).__name__}: {error}".encode()
+        )
+    # The same request always gives the same world
+    return http_response(
+        200, "OK", body, content_type, ["Cache-Control: max-age=86400"]
+    )
+
+
+async def handle_connection(service, reader, writer):
+    """Answer one request on a connection, then close it"""
+    try:
+        request_line = await reader.readline()
+        # The headers don't change the answer
+        while await reader.readline() not in (b"\r\n", b"\n", b""):
+            pass
+        writer.write(await respond(service, request_line))
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(service, host="127.0.0.1", port=8001, path=None):
+    """An asyncio server answering requests with a GenerationService, on a Unix socket at path if given"""
+
+    async def handler(reader, writer):
+        await handle_connection(service, reader, writer)
+
+    if path is not None:
+        return await asyncio.start_unix_server(handler, path)
+    return await asyncio.start_server(handler, host, port)
+
+
+async def serve(args):
+    service = GenerationService(args.workers, args.max_queued, args.timeout)
+    server = await start_server(service, args.host, args.port, args.unix)
+    if args.unix is not None:
+        print(f"Serving worlds on {args.unix}")
+    else:
+        port = server.sockets[0].getsockname()[1]
+        print(f"Serving worlds on http://{args.host}:{port}/world.png")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--max-queued", type=int, default=max_queued)
+    parser.add_argument("--timeout", type=float, default=job_timeout)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,36 @@
+import array
+import contextlib
+import functools
+import heapq
 import random
-import matplotlib.pyplot as plt 
-import matplotlib.colors as colors
+import struct
+import zlib
+from collections import deque
+from dataclasses import asdict, dataclass, fields
+from enum import IntEnum
 
-plt.style.use("seaborn-paper")
+import numpy as np
 
-# Value mapping
+
+class Terrain(IntEnum):
+    """Terrain codes stored in the uint8 terrain map, ordered like their float values"""
+
+    SAND = 0
+    HOLE_CORE = 1
+    HOLE_SIDE = 2
+    SWAMP = 3
+    NEST_BC = 4
+    NEST_SC = 5
+    NEST_SWAMP_SC = 6
+    NEST_STARVED_BC = 7
+
+
+# Int copies of the codes for the per-tile loops, where comparing numpy values against enum members is slow
+SAND, HOLE_CORE, HOLE_SIDE, SWAMP, NEST_BC, NEST_SC, NEST_SWAMP_SC, NEST_STARVED_BC = (
+    map(int, Terrain)
+)
+
+# Value mapping of the float map form
 terrain_sand = 0
 terrain_hole_core = 0.1
 terrain_hole_side = 0.15
@@ -14,568 +40,1579 @@ terrain_nest_sc = 0.4
 terrain_nest_swamp_sc = 0.5
 terrain_nest_starved_bc = 0.6
 
-# Welcome-to-tweak variables
-sinkhole_density = 400  # increases sinkhole spawn chance. choose from 0 - 1000
-sinkhole_min_dist = 14  # minimum distance between sinkholes
-swamp_density = 650  # increases swamp spawn chance. choose from 0 - 1000
-swamp_avg_size = 5  # average buildsize for swampspawns
-sc_nest_density = 8  # increases scnest spawn chance. choose from 0 - 10
-sc_nest_max_hole_dist = 14  # max sc tile distance to sinkhole tiles
-sc_nest_max_swamp_dist = 3  # max sc tile distance to swamp tiles
-
-# Tweak-with-caution variables
-sinkhole_avg_size = 7  # average sinkhole size
-sinkhole_size_deviation = 2  # max deviation from average sinkhole size. Best set lower than sinkhole_avg_size
-bc_nest_density = 8  # increases bcnest spawn chance. choose from 0 - 10
-bc_nest_max_dist = 4  # max distance to a sinkhole tile
-bc_check_radius = 16  # radius in which to check for sinkhole tiles
-bc_load = 800  # weight of othe bc nest tiles
-bc_max_nest_size = 2  # max branching of bc nests
-sc_check_radius = 30  # radius in which to check for sinkhole tiles
-bc_starve_range = 30  # radius in which to check for sc feeding support
-sc_feed_multiplier = 4  # food capacity of sc nests
-
-
-def generate_world(width=100, height=100):
-    """Generates a 2d array of values that represent terrain types"""
-    terrain_map = []
-    # Fill the terrain array with 0's for sand to start
-    for y in range(height):
-        new_row = []
-        for x in range(width):
-            new_row.append(0.0)
-        terrain_map.append(new_row)
-
-    terrain_map = create_sinkholes(terrain_map)
-    terrain_map = create_swamps(terrain_map)
-    terrain_map = create_nests(terrain_map)
-    terrain_map = starve_nests(terrain_map)
+terrain_values = (
+    terrain_sand,
+    terrain_hole_core,
+    terrain_hole_side,
+    terrain_swamp,
+    terrain_nest_bc,
+    terrain_nest_sc,
+    terrain_nest_swamp_sc,
+    terrain_nest_starved_bc,
+)  # indexed by Terrain code
+
+# Legend colours, indexed by Terrain code
+terrain_colours = (
+    "lavender",
+    "slateblue",
+    "slateblue",
+    "olivedrab",
+    "red",
+    "darkturquoise",
+    "orange",
+    "maroon",
+)
+terrain_palette = (
+    (230, 230, 250),
+    (106, 90, 205),
+    (106, 90, 205),
+    (107, 142, 35),
+    (255, 0, 0),
+    (0, 206, 209),
+    (255, 165, 0),
+    (128, 0, 0),
+)  # the same colours as 8 bit RGB
+
+# Bump whenever generate_world gives a different world for the same size, config and rng, so cached worlds from
+# earlier versions are not served
+generator_version = 4
+
+# Kinds of entities an EntityIndex keeps, and the kind each terrain code with entities stands for
+entity_kinds = (
+    "sinkhole_core",
+    "swamp_seed",
+    "bc_nest",
+    "sc_nest",
+    "swamp_sc_nest",
+    "starved_bc_nest",
+)
+terrain_entity_kinds = {
+    HOLE_CORE: "sinkhole_core",
+    NEST_BC: "bc_nest",
+    NEST_SC: "sc_nest",
+    NEST_SWAMP_SC: "swamp_sc_nest",
+    NEST_STARVED_BC: "starved_bc_nest",
+}
+
+# Terrain classes that distance queries measure against
+sinkhole_terrain = (HOLE_CORE, HOLE_SIDE)
+
+# Stage ids, mixed into every CounterRandom draw so each stage draws from its own stream
+stage_cores = 0
+stage_sinkhole_arms = 1
+stage_swamps = 2
+stage_swamp_walks = 3
+stage_bc_nests = 4
+stage_bc_extras = 5
+stage_sc_nests = 6
+
+# right, down, left, up, as spawn_bc_nest picks them
+bc_directions = ((1, 0), (0, 1), (-1, 0), (0, -1))
+
+no_distance = 99999  # distance reported when no tile of a class exists
+
+
+@dataclass(frozen=True, slots=True)
+class GenerationConfig:
+    """Tuning of a generated world. Configs can't change once made, so one can be shared by any number of
+    generations at a time. Derive variations with dataclasses.replace."""
+
+    # Welcome-to-tweak variables
+    sinkhole_density: int = 400  # increases sinkhole spawn chance. choose from 0 - 1000
+    sinkhole_min_dist: int = 14  # minimum distance between sinkholes
+    swamp_density: int = 650  # increases swamp spawn chance. choose from 0 - 1000
+    swamp_avg_size: int = 5  # average buildsize for swampspawns
+    sc_nest_density: int = 8  # increases scnest spawn chance. choose from 0 - 10
+    sc_nest_max_hole_dist: int = 14  # max sc tile distance to sinkhole tiles
+    sc_nest_max_swamp_dist: int = 3  # max sc tile distance to swamp tiles
+
+    # Tweak-with-caution variables
+    sinkhole_avg_size: int = 7  # average sinkhole size
+    sinkhole_size_deviation: int = (
+        2  # max deviation from average sinkhole size. Best set lower than sinkhole_avg_size
+    )
+    bc_nest_density: int = 8  # increases bcnest spawn chance. choose from 0 - 10
+    bc_nest_max_dist: int = 4  # max distance to a sinkhole tile
+    bc_check_radius: int = 16  # radius in which to check for sinkhole tiles
+    bc_load: int = 800  # weight of othe bc nest tiles
+    bc_max_nest_size: int = 2  # max branching of bc nests
+    sc_check_radius: int = 30  # radius in which to check for sinkhole tiles
+    bc_starve_range: int = 30  # radius in which to check for sc feeding support
+    sc_feed_multiplier: int = 4  # food capacity of sc nests
+
+    # Swamp spiral shape, see swamp_walk
+    swamp_min_size: int = 1  # fewest spiral loops
+    swamp_max_size: int = 2  # most spiral loops, before the distance bonus
+    swamp_min_arm: int = 1
+    swamp_max_arm: int = 3
+    swamp_max_bonus: int = 12  # largest swamp_size_bonus
+
+    def __post_init__(self):
+        for field in fields(self):
+            if type(getattr(self, field.name)) is not int:
+                raise TypeError(f"{field.name} must be an int")
+
+    def stable_hash(self):
+        """Hex digest of the settings, the same across processes and runs, for naming cached or shared results"""
+        # Only imported here, generation workers that never hash a config don't pay for them
+        import hashlib
+        import json
+
+        settings = json.dumps(asdict(self), sort_keys=True)
+        return hashlib.sha256(settings.encode()).hexdigest()
+
+
+default_config = GenerationConfig()
+
+# The config fields each stage of generate_world reads, in stage order
+stage_config_fields = {
+    "create_sinkholes": (
+        "sinkhole_density",
+        "sinkhole_min_dist",
+        "sinkhole_avg_size",
+        "sinkhole_size_deviation",
+    ),
+    "create_swamps": (
+        "swamp_density",
+        "swamp_min_size",
+        "swamp_max_size",
+        "swamp_min_arm",
+        "swamp_max_arm",
+        "swamp_max_bonus",
+    ),
+    "create_nests": (
+        "bc_nest_density",
+        "bc_nest_max_dist",
+        "bc_check_radius",
+        "bc_load",
+        "bc_max_nest_size",
+        "sc_nest_density",
+        "sc_nest_max_hole_dist",
+        "sc_nest_max_swamp_dist",
+        "sc_check_radius",
+    ),
+    "starve_nests": ("bc_starve_range", "sc_feed_multiplier"),
+}
+
+
+def generate_world(
+    width=100,
+    height=100,
+    as_float_map=False,
+    config=default_config,
+    rng=random,
+    profile=None,
+    checkpoints=None,
+    entities=None,
+):
+    """Generates a 2d uint8 array of Terrain codes, or the float map form of it when as_float_map is set. Every draw
+    comes from rng, a random.Random, the module level random stream by default. A profiling.GenerationProfile passed
+    as profile records what each stage did. Passing the same StageCheckpoints to runs that start from the same rng
+    state only re-runs the stages whose config fields changed. An EntityIndex passed as entities is filled with the
+    sinkholes, swamps and nests of the world."""
+    stages = (
+        ("create_sinkholes", create_sinkholes),
+        ("create_swamps", create_swamps),
+        ("create_nests", create_nests),
+        ("starve_nests", starve_stage),
+    )
+    if entities is None:
+        entities = EntityIndex()
+    first_stage = 0
+    if checkpoints is not None:
+        first_stage, terrain_map, saved_entities = checkpoints.resume(
+            width, height, config, rng
+        )
+    if first_stage == 0:
+        # Fill the terrain array with sand to start
+        terrain_map = np.full((height, width), SAND, dtype=np.uint8)
+        entities.replace(EntityIndex(entities.bucket_size))
+    else:
+        entities.replace(saved_entities)
 
+    # Distance and neighbourhood queries are answered from an index that follows every painted tile
+    if profile is None:
+        index = TerrainIndex(terrain_map, entities)
+        stage = unprofiled_stage
+    else:
+        index = profile.index(terrain_map, entities)
+        stage = profile.stage
+
+    for name, run_stage in stages[first_stage:]:
+        with stage(name, terrain_map):
+            run_stage(terrain_map, index, config, rng)
+        if checkpoints is not None:
+            checkpoints.save(name, config, terrain_map, rng, entities)
+
+    if as_float_map:
+        return to_float_map(terrain_map)
+    return terrain_map
+
+
+class StageCheckpoints:
+    """The terrain map, entities and rng state after each stage of a generate_world run. A later run from the same
+    size and rng state starts from the last stage whose config fields, and those of every stage before it, are
+    unchanged."""
+
+    def __init__(self):
+        self.start = None  # size and rng state the checkpointed run started from
+        # Config values, terrain map, entities and rng state after each stage, in stage order
+        self.saved = []
+
+    def resume(self, width, height, config, rng):
+        """Number of stages that can be skipped and the terrain map and entities to continue from, with rng set to
+        the state the next stage starts in"""
+        start = (width, height, rng.getstate())
+        if start != self.start:
+            self.start = start
+            self.saved = []
+        kept = 0
+        for name, saved in zip(stage_config_fields, self.saved):
+            if saved[0] != stage_config_values(name, config):
+                break
+            kept += 1
+        del self.saved[kept:]
+        if kept == 0:
+            return 0, None, None
+        values, terrain_map, entities, state = self.saved[-1]
+        rng.setstate(state)
+        return kept, terrain_map.copy(), entities.copy()
+
+    def save(self, name, config, terrain_map, rng, entities):
+        """Checkpoint the stage that just ran"""
+        self.saved.append(
+            (
+                stage_config_values(name, config),
+                terrain_map.copy(),
+                entities.copy(),
+                rng.getstate(),
+            )
+        )
+
+
+def stage_config_values(name, config):
+    """The values of the config fields a stage reads"""
+    return tuple(getattr(config, field) for field in stage_config_fields[name])
+
+
+def unprofiled_stage(name, terrain_map):
+    """Stand-in for GenerationProfile.stage when nothing is profiled"""
+    return contextlib.nullcontext()
+
+
+def to_float_map(terrain_map):
+    """Convert a terrain code array to the nested list of float values older callers expect"""
+    return np.asarray(terrain_values)[terrain_map].tolist()
+
+
+def from_float_map(float_map):
+    """Convert a nested list of float values back to a terrain code array"""
+    float_map = np.asarray(float_map)
+    terrain_map = np.zeros(float_map.shape, dtype=np.uint8)
+    for code, value in enumerate(terrain_values):
+        terrain_map[float_map == value] = code
     return terrain_map
 
 
-def generate_image(noise_map):
-    cmap = colors.ListedColormap(
+def generate_image(noise_map, path="world.png", scale=1, backend="png"):
+    """Render a terrain map in the legend colours. The png backend writes scale by scale pixels per tile, the
+    matplotlib backend a 20 by 10 inch figure."""
+    if not isinstance(noise_map, np.ndarray):
+        noise_map = from_float_map(noise_map)
+    if backend == "matplotlib":
+        return plot_image(noise_map, path)
+    if backend != "png":
+        raise ValueError(f"unknown image backend {backend!r}")
+    with open(path, "wb") as file:
+        file.write(encode_png(noise_map, scale))
+
+
+def encode_png(terrain_map, scale=1):
+    """An indexed colour PNG of a terrain code array, with terrain_palette as its palette, scale by scale pixels a
+    tile"""
+    if not isinstance(scale, (int, np.integer)) or scale < 1:
+        raise ValueError(f"scale must be an int of at least 1, not {scale!r}")
+    if scale > 1:
+        terrain_map = terrain_map.repeat(scale, axis=0).repeat(scale, axis=1)
+    height, width = terrain_map.shape
+    # Every scanline starts with its filter type, 0 for none
+    scanlines = np.zeros((height, width + 1), dtype=np.uint8)
+    scanlines[:, 1:] = terrain_map
+    header = struct.pack(">IIBBBBB", width, height, 8, 3, 0, 0, 0)
+    palette = bytes(channel for colour in terrain_palette for channel in colour)
+    return b"".join(
         [
-            "lavender",
-            "slateblue",
-            "slateblue",
-            "olivedrab",
-            "red",
-            "darkturquoise",
-            "orange",
-            "maroon",
+            b"\x89PNG\r\n\x1a\n",
+            png_chunk(b"IHDR", header),
+            png_chunk(b"PLTE", palette),
+            png_chunk(b"IDAT", zlib.compress(scanlines.tobytes(), 6)),
+            png_chunk(b"IEND", b""),
         ]
     )
 
-    bounds = [
-        0,
-        terrain_hole_core,
-        terrain_hole_side,
-        terrain_swamp,
-        terrain_nest_bc,
-        terrain_nest_sc,
-        terrain_nest_swamp_sc,
-        terrain_nest_starved_bc,
-        0.7,
-    ]
+
+def png_chunk(chunk_type, data):
+    """A PNG chunk: length, type, data and the CRC of type and data"""
+    return (
+        struct.pack(">I", len(data))
+        + chunk_type
+        + data
+        + struct.pack(">I", zlib.crc32(chunk_type + data))
+    )
+
+
+def plot_image(terrain_map, path):
+    """The matplotlib backend of generate_image"""
+    plt = pyplot()
+    import matplotlib.colors as colors
+
+    cmap = colors.ListedColormap(list(terrain_colours))
+
+    bounds = list(range(len(Terrain) + 1))  # one bin per terrain code
     norm = colors.BoundaryNorm(bounds, cmap.N)
-    plt.rcParams["figure.figsize"] = (20, 10)
-    img = plt.imshow(noise_map, cmap=cmap, norm=norm)
-    # img = plt.imshow(noise_map)
+    figure = plt.figure(figsize=(20, 10))
+    img = plt.imshow(terrain_map, cmap=cmap, norm=norm)
 
     plt.axis("off")
-    plt.savefig("world.png", bbox_inches="tight")
+    plt.savefig(path, bbox_inches="tight")
+    # Close the figure, or every call keeps one more alive
+    plt.close(figure)
+
 
+@functools.cache
+def pyplot():
+    """matplotlib.pyplot, imported on first use so that generating worlds never pays for it"""
+    import matplotlib.pyplot as plt
 
-def create_sinkholes(terrain_map):
+    # The seaborn styles were renamed in matplotlib 3.6, and the old names dropped in 3.8
+    for style in ("seaborn-v0_8-paper", "seaborn-paper"):
+        if style in plt.style.available:
+            plt.style.use(style)
+            break
+    return plt
+
+
+def create_sinkholes(terrain_map, index=None, config=default_config, rng=random):
     """Sinkholes are defined by a core tile, all of which are first placed, and then 'periphery' or 'side' tiles are constructed each"""
-    height = len(terrain_map)
-    width = len(terrain_map[0])
-
-    # place the first core in a random position
-    random_spot_x = random.randint(0, width - 1)
-    random_spot_y = random.randint(0, height - 1)
-    terrain_map[random_spot_y][random_spot_x] = terrain_hole_core
-
-    # check each tile for potential placement of more cores
-    for y in range(height):
-        for x in range(width):
-            if (
-                sinkhole_adjacent(terrain_map, x, y) == False
-            ):  # no sinkholes directly adjacent to this spot. This might just be obsolete due to distance check 3 lines below
-                z = random.randint(
-                    0, (1000 - sinkhole_density)
-                )  # random chacnce at spawning core tiles
-                if z == 0:
-                    if (
-                        distance_to_closest_sinkhole(terrain_map, x, y)
-                        > sinkhole_min_dist + sinkhole_avg_size
-                    ):  # it's far away enough from other sinkholes
-                        terrain_map[y][x] = terrain_hole_core  # place core
+    height, width = terrain_map.shape
+    if index is None:
+        index = TerrainIndex(terrain_map)
+    source = CounterRandom(rng.getrandbits(64))
+    # Placed cores are bucketed by the spacing they keep, so each check only looks at the buckets around a tile
+    core_spacing = config.sinkhole_min_dist + config.sinkhole_avg_size
+    placed_cores = SpatialHash(core_spacing)
+
+    # place the first core in a random position, drawn from an address outside the map
+    random_spot_x = int(source.integers(stage_cores, 0, width, -1, -1, 0))
+    random_spot_y = int(source.integers(stage_cores, 0, height, -1, -1, 1))
+    index.paint(random_spot_x, random_spot_y, HOLE_CORE)
+    place_core(placed_cores, width, height, random_spot_x, random_spot_y)
+
+    # random chance at spawning core tiles, rolled for every tile at once
+    ys, xs = np.ogrid[:height, :width]
+    roll = source.integers(stage_cores, 0, 1001 - config.sinkhole_density, xs, ys)
+    # Only the tiles that rolled are checked, in row-major order, against the cores placed before them
+    for y, x in np.argwhere(roll == 0).tolist():
+        if (
+            index.sinkhole_adjacent(x, y) == False
+        ):  # no sinkholes directly adjacent to this spot. This might just be obsolete due to distance check 3 lines below
+            if not placed_cores.any_within(
+                x, y, core_spacing
+            ):  # it's far away enough from other sinkholes
+                index.paint(x, y, HOLE_CORE)  # place core
+                place_core(placed_cores, width, height, x, y)
 
     # build peripheries
-    pointy_offset = 0
-    for y in range(height):
-        for x in range(width):
-            if terrain_map[y][x] == terrain_hole_core:  # A core tile is found.
-                # Set some sizes
-                sinkhole_size = random.randint(0, sinkhole_avg_size)
-                sinkhole_min_arm_size = sinkhole_avg_size - 3
-                deviation_amount_north = sinkhole_size - random.randint(
-                    0, sinkhole_size_deviation
-                )
-                pointy_offset = random.randint(0, 1)
-                if deviation_amount_north <= sinkhole_min_arm_size:
-                    deviation_amount_north = sinkhole_min_arm_size
-                # Draw a line of tiles outward, then draw towards it in steps to create a circle-like structure
-                # Do this upwards
-                for b in range(deviation_amount_north):
-                    if (y - b >= 0) & (y + b <= height - 1) & (b != 0):
-                        terrain_map[y - b][x] = terrain_hole_side
-                        for c in range(deviation_amount_north - b + pointy_offset):
-                            if x + c <= width - 1:
-                                terrain_map[y - b][x + c] = terrain_hole_side
-                        for c in range(deviation_amount_north - b + pointy_offset):
-                            if x - c >= 0:
-                                terrain_map[y - b][x - c] = terrain_hole_side
-                deviation_amount_south = sinkhole_size - random.randint(
-                    0, (sinkhole_size_deviation)
-                )
-                if deviation_amount_south <= sinkhole_min_arm_size:
-                    deviation_amount_south = sinkhole_min_arm_size
-                # Downwards
-                for b in range(deviation_amount_south):
-                    if (y - b >= 0) & (y + b <= height - 1) & (b != 0):
-                        terrain_map[y + b][x] = terrain_hole_side
-                        for c in range(deviation_amount_south - b + pointy_offset):
-                            if x + c <= width - 1:
-                                terrain_map[y + b][x + c] = terrain_hole_side
-                        for c in range(deviation_amount_south - b + pointy_offset):
-                            if x - c >= 0:
-                                terrain_map[y + b][x - c] = terrain_hole_side
-                deviation_amount_east = sinkhole_size - random.randint(
-                    0, (sinkhole_size_deviation)
-                )
-                if deviation_amount_east <= sinkhole_min_arm_size:
-                    deviation_amount_east = sinkhole_min_arm_size
-                # Rightwards
-                for a in range(deviation_amount_east):
-                    if (x - a >= 0) & (x + a <= width - 1) & (a != 0):
-                        terrain_map[y][x - a] = terrain_hole_side
-                        for c in range(deviation_amount_east - a + pointy_offset):
-                            if y + c <= height - 1:
-                                terrain_map[y + c][x - a] = terrain_hole_side
-                        for c in range(deviation_amount_east - a + pointy_offset):
-                            if y - c >= 0:
-                                terrain_map[y - c][x - a] = terrain_hole_side
-                deviation_amount_west = sinkhole_size - random.randint(
-                    0, (sinkhole_size_deviation)
-                )
-                if deviation_amount_west <= sinkhole_min_arm_size:
-                    deviation_amount_west = sinkhole_min_arm_size
-                # Leftwards
-                for a in range(deviation_amount_west):
-                    if (x - a >= 0) & (x + a <= width - 1) & (a != 0):
-                        terrain_map[y][x + a] = terrain_hole_side
-                        for c in range(deviation_amount_west - a + pointy_offset):
-                            if (y + c <= height - 1) & (x + a <= width - 1):
-                                terrain_map[y + c][x + a] = terrain_hole_side
-                        for c in range(deviation_amount_west - a + pointy_offset):
-                            if (y - c >= 0) & (x + a <= width - 1):
-                                terrain_map[y - c][x + a] = terrain_hole_side
+    for x, y in index.entities.points("sinkhole_core"):
+        # A core tile is found, unless an earlier periphery already drew over it
+        if terrain_map[y, x] == HOLE_CORE:
+            arms = sinkhole_arms(source.tile_random(stage_sinkhole_arms, x, y), config)
+            index.entities.add("sinkhole_core", x, y, arms)
+            draw_periphery(index, x, y, *arms)
 
     return terrain_map
 
 
-def create_swamps(terrain_map):
-    """Choose random locations at random, then create a spiraling noisy shape"""
-    height = len(terrain_map)
-    width = len(terrain_map[0])
+def sinkhole_arms(rng, config=default_config):
+    """Draw the (north, south, east, west, pointy_offset) arm sizes of a sinkhole from rng"""
+    # Set some sizes
+    sinkhole_size = rng.randint(0, config.sinkhole_avg_size)
+    sinkhole_min_arm_size = config.sinkhole_avg_size - 3
+    deviation_amount_north = sinkhole_size - rng.randint(
+        0, config.sinkhole_size_deviation
+    )
+    pointy_offset = rng.randint(0, 1)
+    if deviation_amount_north <= sinkhole_min_arm_size:
+        deviation_amount_north = sinkhole_min_arm_size
+    deviation_amount_south = sinkhole_size - rng.randint(
+        0, (config.sinkhole_size_deviation)
+    )
+    if deviation_amount_south <= sinkhole_min_arm_size:
+        deviation_amount_south = sinkhole_min_arm_size
+    deviation_amount_east = sinkhole_size - rng.randint(
+        0, (config.sinkhole_size_deviation)
+    )
+    if deviation_amount_east <= sinkhole_min_arm_size:
+        deviation_amount_east = sinkhole_min_arm_size
+    deviation_amount_west = sinkhole_size - rng.randint(
+        0, (config.sinkhole_size_deviation)
+    )
+    if deviation_amount_west <= sinkhole_min_arm_size:
+        deviation_amount_west = sinkhole_min_arm_size
+    return (
+        deviation_amount_north,
+        deviation_amount_south,
+        deviation_amount_east,
+        deviation_amount_west,
+        pointy_offset,
+    )
+
+
+@functools.cache
+def sinkhole_stencil(north, south, east, west, pointy_offset):
+    """The periphery of a sinkhole with the given arm sizes, as boolean masks centred on its core: one for the
+    northern and southern arms, one for the eastern and western arms, and their union"""
+    reach = max(north, south, east, west, 0) + pointy_offset
+    size = 2 * reach + 1
+    vertical = np.zeros((size, size), dtype=bool)
+    horizontal = np.zeros((size, size), dtype=bool)
+    # Draw a line of tiles outward, then draw towards it in steps to create a circle-like structure
+    for b in range(1, north):
+        half_width = north - b + pointy_offset - 1
+        vertical[reach - b, reach - half_width : reach + half_width + 1] = True
+    for b in range(1, south):
+        half_width = south - b + pointy_offset - 1
+        vertical[reach + b, reach - half_width : reach + half_width + 1] = True
+    # The eastern arm has always been drawn to the left of the core, and the western one to the right
+    for a in range(1, east):
+        half_width = east - a + pointy_offset - 1
+        horizontal[reach - half_width : reach + half_width + 1, reach - a] = True
+    for a in range(1, west):
+        half_width = west - a + pointy_offset - 1
+        horizontal[reach - half_width : reach + half_width + 1, reach + a] = True
+    footprint = vertical | horizontal
+    for mask in (vertical, horizontal, footprint):
+        mask.flags.writeable = False
+    return reach, vertical, horizontal, footprint
+
+
+def draw_periphery(index, x, y, north, south, east, west, pointy_offset):
+    """Stamp the side tiles of the sinkhole around the core at x, y"""
+    height, width = index.terrain_map.shape
+    reach, vertical, horizontal, footprint = sinkhole_stencil(
+        north, south, east, west, pointy_offset
+    )
+    # An arm row or column is only drawn when the core is at least as far from the opposite edge too
+    row_reach = min(y, height - 1 - y)
+    column_reach = min(x, width - 1 - x)
+    if (row_reach < reach) | (column_reach < reach):
+        offsets = np.abs(np.arange(-reach, reach + 1))
+        footprint = (vertical & (offsets <= row_reach)[:, None]) | (
+            horizontal & (offsets <= column_reach)[None, :]
+        )
+    # Clip the stencil to the map
+    top = max(y - reach, 0)
+    left = max(x - reach, 0)
+    bottom = min(y + reach + 1, height)
+    right = min(x + reach + 1, width)
+    rows = slice(top - y + reach, bottom - y + reach)
+    columns = slice(left - x + reach, right - x + reach)
+    index.paint_mask(left, top, footprint[rows, columns], HOLE_SIDE)
 
-    for y in range(height):
-        for x in range(width):
-            if terrain_map[y][x] == 0:
-                z = random.randint(0, (1000 - swamp_density))
-                if z == 2:
-                    if sinkhole_adjacent(terrain_map, x, y) == False:
-                        create_swamp(terrain_map, x, y)
+
+def place_core(placed_cores, width, height, x, y):
+    """Track a core for the spacing checks. Like the full-map distance scan these checks used to make, a core in the
+    last row or column is not seen."""
+    if (x < width - 1) & (y < height - 1):
+        placed_cores.add(x, y)
+
+
+def create_swamps(terrain_map, index=None, config=default_config, rng=random):
+    """Choose random locations at random, then create a spiraling noisy shape from each. The seeds and every
+    spiral are drawn at once, from a CounterRandom seeded by rng, and laid down in row-major seed order.
+    """
+    height, width = terrain_map.shape
+    if index is None:
+        index = TerrainIndex(terrain_map)
+    source = CounterRandom(rng.getrandbits(64))
+
+    # Sinkholes do not change during this stage, so which tiles they block and how far away they are is fixed
+    ys, xs = np.ogrid[:height, :width]
+    roll = source.integers(stage_swamps, 0, 1001 - config.swamp_density, xs, ys)
+    ys, xs = np.nonzero((roll == 2) & (terrain_map == SAND))
+    open_seed = ~index.sinkhole_adjacent_tiles(xs, ys)
+    ys, xs = ys[open_seed], xs[open_seed]
+    dist_bonus = np.array(
+        [
+            swamp_size_bonus(height + width, hole_dist, config)
+            for hole_dist in index.distances(xs, ys, sinkhole_terrain).tolist()
+        ],
+        dtype=np.int64,
+    )
+    walk_seed, walk_xs, walk_ys = swamp_walks(source, xs, ys, dist_bonus, config)
+    # The top row is never walked onto, only seeded
+    walked = (walk_xs >= 0) & (walk_xs < width) & (walk_ys > 0) & (walk_ys < height)
+    walked[walked] = ~index.sinkhole_adjacent_tiles(walk_xs[walked], walk_ys[walked])
+    walk_seed, walk_tiles = walk_seed[walked], (walk_ys * width + walk_xs)[walked]
+    walk_bounds = np.searchsorted(walk_seed, np.arange(len(xs) + 1)).tolist()
+
+    # sinkhole_adjacent also counts a swamp to the west of a tile as a sinkhole, unless the tile north of it is
+    # swamp as well, so whether a tile can be painted depends on the tiles painted before it, and each spiral is walked
+    # over in turn. The tiles are flat indices into a copy of the map, the north of the top row wrapping around.
+    tiles = bytearray(terrain_map.tobytes())
+    swamp = []
+    for seed, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+        tile = y * width + x
+        if (tiles[tile] != SAND) | (
+            (x != 0)
+            & (tiles[tile - 1] >= HOLE_CORE)
+            & (tiles[tile - width] <= HOLE_SIDE)
+        ):
+            continue
+        painted = [tile]
+        tiles[tile] = SWAMP
+        for tile in walk_tiles[walk_bounds[seed] : walk_bounds[seed + 1]].tolist():
+            if tiles[tile] == SAND:
+                if (
+                    (tile % width == 0)
+                    | (tiles[tile - 1] < HOLE_CORE)
+                    | (tiles[tile - width] > HOLE_SIDE)
+                ):
+                    painted.append(tile)
+                    tiles[tile] = SWAMP
+        # The extent only covers the tiles this seed painted, not those of earlier swamps it crossed
+        painted_ys, painted_xs = np.divmod(painted, width)
+        extent = (
+            int(painted_xs.min()),
+            int(painted_ys.min()),
+            int(painted_xs.max()),
+            int(painted_ys.max()),
+        )
+        index.entities.add("swamp_seed", x, y, extent)
+        swamp.extend(painted)
+    swamp_mask = np.zeros(width * height, dtype=bool)
+    swamp_mask[swamp] = True
+    index.paint_mask(0, 0, swamp_mask.reshape(height, width), SWAMP)
 
     return terrain_map
 
 
-def create_swamp(terrain_map, x, y):
+def create_swamp(terrain_map, x, y, index=None, config=default_config, rng=random):
     """Create a random shape through a spiraling for-loop, with a bonus for distance from sinkholes"""
-    height = len(terrain_map)
-    width = len(terrain_map[0])
-    min_size = 1
-    max_size = 2
-    min_arm = 1
-    max_arm = 3
-    dist_bonus = 1
+    height, width = terrain_map.shape
+    if index is None:
+        index = TerrainIndex(terrain_map)
     total_size = height + width
     # The growth of swamps is inhibited by the spillover of sinkhole vapor, so they get an avg size bonus based on distance to closest sinkhole
-    min_dist = distance_to_closest_sinkhole(terrain_map, x, y)
+    min_dist = distance_to_closest_sinkhole(terrain_map, x, y, index)
+    dist_bonus = swamp_size_bonus(total_size, min_dist, config)
+    # The seed is kept with the extent of the tiles it painted: left, top, right, bottom
+    extent = None
+    if index.sinkhole_adjacent(x, y) == False:
+        index.paint(x, y, SWAMP)
+        extent = (x, y, x, y)
+    for xNew, yNew in swamp_walk(rng, x, y, dist_bonus, config):
+        if (xNew >= 0) & (xNew <= width - 1) & (yNew > 0) & (yNew <= height - 1):
+            if (terrain_map[yNew, xNew] == SAND) & (
+                index.sinkhole_adjacent(xNew, yNew) == False
+            ):
+                index.paint(xNew, yNew, SWAMP)
+                if extent is None:
+                    extent = (xNew, yNew, xNew, yNew)
+                else:
+                    extent = (
+                        min(extent[0], xNew),
+                        min(extent[1], yNew),
+                        max(extent[2], xNew),
+                        max(extent[3], yNew),
+                    )
+    index.entities.add("swamp_seed", x, y, extent)
+
+
+def swamp_size_bonus(total_size, min_dist, config=default_config):
+    """Spiral loop multiplier for a swamp seed min_dist away from the closest sinkhole, on a map of width + height total_size"""
+    dist_bonus = 1
     if (total_size / min_dist) < 5:
-        dist_bonus = 12
+        dist_bonus = config.swamp_max_bonus
     elif (total_size / min_dist) < 8:
         dist_bonus = 8
     elif (total_size / min_dist) < 12:
         dist_bonus = 5
     elif (total_size / min_dist) < 16:
         dist_bonus = 3
-    if sinkhole_adjacent(terrain_map, x, y) == False:
-        terrain_map[y][x] = terrain_swamp
+    return dist_bonus
+
+
+def swamp_walk(rng, x, y, dist_bonus, config=default_config):
+    """Yield the tiles a swamp spiral from x, y passes over, drawing its loop count and arm lengths from rng"""
     xNew = x
     yNew = y
     # In each of four directions, create lines of swamptiles of varying lengths
-    for a in range(random.randint(min_size, (max_size * dist_bonus))):
-        arm_length = random.randint(min_arm, max_arm)
+    for a in range(
+        rng.randint(config.swamp_min_size, (config.swamp_max_size * dist_bonus))
+    ):
+        arm_length = rng.randint(config.swamp_min_arm, config.swamp_max_arm)
         for b in range(arm_length):
             xNew += 1
-            if (xNew >= 0) & (xNew <= width - 1) & (yNew > 0) & (yNew <= height - 1):
-                if (terrain_map[yNew][xNew] == 0) & (
-                    sinkhole_adjacent(terrain_map, xNew, yNew) == False
-                ):
-                    terrain_map[yNew][xNew] = terrain_swamp
-        arm_length = random.randint(min_arm, max_arm)
+            yield xNew, yNew
+        arm_length = rng.randint(config.swamp_min_arm, config.swamp_max_arm)
         for b in range(arm_length):
             yNew -= 1
-            if (xNew >= 0) & (xNew <= width - 1) & (yNew > 0) & (yNew <= height - 1):
-                if (terrain_map[yNew][xNew] == 0) & (
-                    sinkhole_adjacent(terrain_map, xNew, yNew) == False
-                ):
-                    terrain_map[yNew][xNew] = terrain_swamp
-        arm_length = random.randint(min_arm, max_arm)
+            yield xNew, yNew
+        arm_length = rng.randint(config.swamp_min_arm, config.swamp_max_arm)
         for b in range(arm_length):
             xNew -= 1
-            if (xNew >= 0) & (xNew <= width - 1) & (yNew > 0) & (yNew <= height - 1):
-                if (terrain_map[yNew][xNew] == 0) & (
-                    sinkhole_adjacent(terrain_map, xNew, yNew) == False
-                ):
-                    terrain_map[yNew][xNew] = terrain_swamp
-            if random.randint(0, 1) == 1:
+            yield xNew, yNew
+            if rng.randint(0, 1) == 1:
                 xNew -= 1
-        arm_length = random.randint(min_arm, max_arm)
+        arm_length = rng.randint(config.swamp_min_arm, config.swamp_max_arm)
         for b in range(arm_length):
             yNew += 1
-            if (xNew >= 0) & (xNew <= width - 1) & (yNew > 0) & (yNew <= height - 1):
-                if (terrain_map[yNew][xNew] == 0) & (
-                    sinkhole_adjacent(terrain_map, xNew, yNew) == False
-                ):
-                    terrain_map[yNew][xNew] = terrain_swamp
-
-
-def create_nests(terrain_map):
-    """Create BC nests, then SC nests"""
-    height = len(terrain_map)
-    width = len(terrain_map[0])
-
-    sc_nest_count = 0
-    # BCnests spawn randomly, but at a max dist from sinkholes
-    for y in range(height):
-        for x in range(width):
-            z = random.randint(0, (10 - bc_nest_density))
-            if z == 1:
-                if distance_to_closest_sinkhole(terrain_map, x, y) <= bc_nest_max_dist:
-                    spawn_bc_nest(terrain_map, x, y)
-
-    # SCnests spawn in or near swamps, need sinkholes within range for sustenance
-    for y in range(height):
-        for x in range(width):
-            z = random.randint(0, (10 - sc_nest_density))
-            if z == 1:
-                if (
-                    distance_to_closest_sinkhole(terrain_map, x, y)
-                    <= sc_nest_max_hole_dist
-                ):
-                    if (
-                        distance_to_closest_terrain_type(
-                            terrain_map, x, y, terrain_swamp
-                        )
-                        <= sc_nest_max_swamp_dist
+            yield xNew, yNew
+
+
+def swamp_walks(source, xs, ys, dist_bonus, config=default_config):
+    """The tiles the swamp spirals from xs, ys pass over, as swamp_walk would yield them. Every loop count, arm
+    length and westward stumble is a CounterRandom draw addressed by the seed's tile, so a spiral comes out the same
+    whichever seeds it is walked with. Returns the seed number, x and y of every step, grouped by seed.
+    """
+    # Draw 0 of a seed is its loop count, the next ones its arm lengths and then a stumble for each step
+    loops = source.integers(
+        stage_swamp_walks,
+        config.swamp_min_size,
+        config.swamp_max_size * dist_bonus + 1,
+        xs,
+        ys,
+    )
+    arm_seed = np.repeat(np.arange(len(xs)), 4 * loops)
+    arm_number = np.arange(len(arm_seed)) - (np.cumsum(4 * loops) - 4 * loops)[arm_seed]
+    arm_lengths = source.integers(
+        stage_swamp_walks,
+        config.swamp_min_arm,
+        config.swamp_max_arm + 1,
+        xs[arm_seed],
+        ys[arm_seed],
+        1 + arm_number,
+    )
+    # Arms go east, north, west and south in turn
+    arm_direction = np.tile(np.arange(4), int(loops.sum()))
+    step_seed = np.repeat(arm_seed, arm_lengths)
+    seed_steps = np.bincount(step_seed, minlength=len(xs))
+    seed_start = np.cumsum(seed_steps) - seed_steps
+    step_number = np.arange(len(step_seed)) - seed_start[step_seed]
+    step_direction = np.repeat(arm_direction, arm_lengths)
+    step_x = np.array([1, 0, -1, 0])[step_direction]
+    step_y = np.array([0, -1, 0, 1])[step_direction]
+    # Half the westward steps stumble one tile further west after being walked over
+    stumbled = source.integers(
+        stage_swamp_walks,
+        0,
+        2,
+        xs[step_seed],
+        ys[step_seed],
+        1 + 4 * loops[step_seed] + step_number,
+    )
+    stumble = np.where((step_direction == 2) & (stumbled == 1), -1, 0)
+
+    def walked(steps, after):
+        """Running sum of steps, plus that of after up to the step before, restarted at every seed"""
+        total = np.cumsum(steps) + np.cumsum(after) - after
+        return total - (total - steps)[seed_start[step_seed]]
+
+    return (
+        step_seed,
+        xs[step_seed] + walked(step_x, stumble),
+        ys[step_seed] + walked(step_y, np.zeros_like(step_y)),
+    )
+
+
+def create_nests(terrain_map, index=None, config=default_config, rng=random):
+    """Create BC nests, then SC nests. Every tile's roll is drawn at once, from a CounterRandom seeded by rng,
+    and the rules that do not depend on earlier nests are applied to all tiles as masks. Only the tiles left over
+    are visited, in row-major order."""
+    height, width = terrain_map.shape
+    if index is None:
+        index = TerrainIndex(terrain_map)
+    source = CounterRandom(rng.getrandbits(64))
+    tile_ys, tile_xs = np.ogrid[:height, :width]
+
+    # BCnests spawn randomly, but at a max dist from sinkholes. BC nests are only painted over sand, so the
+    # sinkholes stay put until the SC nests.
+    roll = source.integers(
+        stage_bc_nests, 0, 11 - config.bc_nest_density, tile_xs, tile_ys
+    )
+    ys, xs = np.nonzero(roll == 1)
+    near = index.distances(xs, ys, sinkhole_terrain) <= config.bc_nest_max_dist
+    ys, xs = ys[near], xs[near]
+    extra_rolls, extra_directions = bc_extra_draws(source, xs, ys, config)
+    hole_tile_totals = index.cross_counts(
+        xs, ys, config.bc_check_radius, sinkhole_terrain
+    ).tolist()
+    for nest, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+        # Each BC nest takes bc_load of the sinkhole tiles in the radius, so earlier nests leave less surplus
+        bc_tile_total = index.cross_count(x, y, config.bc_check_radius, (NEST_BC,))
+        surplus = hole_tile_totals[nest] - (bc_tile_total * config.bc_load)
+        for b in range(min(surplus, config.bc_max_nest_size)):
+            if extra_rolls[nest][b] == 0:
+                # create a tile. Arbitrarily check right, then down, then left, then up
+                dx, dy = bc_directions[extra_directions[nest][b]]
+                tile_x, tile_y = x + dx * b, y + dy * b
+                if (0 <= tile_x < width) & (0 <= tile_y < height):
+                    if (terrain_map[tile_y, tile_x] == SAND) & (
+                        index.distance(tile_x, tile_y, sinkhole_terrain)
+                        < config.bc_nest_max_dist
                     ):
-                        sc_nest_count += 1
-                        spawn_sc_nest(terrain_map, x, y)
+                        index.paint(tile_x, tile_y, NEST_BC)
+
+    # SCnests spawn in or near swamps, need sinkholes within range for sustenance. Tiles only ever turn into SC
+    # nests from here on, so no tile gets closer to a sinkhole or a swamp, and the distance to BC nests stays the
+    # same, as the only BC tiles an SC nest can land on are those the BC distance field ignores.
+    roll = source.integers(
+        stage_sc_nests, 0, 11 - config.sc_nest_density, tile_xs, tile_ys
+    )
+    ys, xs = np.nonzero(roll == 1)
+    swamp_dist = index.distances(xs, ys, (SWAMP,))
+    bc_dist = index.distances(xs, ys, (NEST_BC,))
+    near = (
+        (index.distances(xs, ys, sinkhole_terrain) <= config.sc_nest_max_hole_dist)
+        & (swamp_dist <= config.sc_nest_max_swamp_dist)
+        & (swamp_dist < bc_dist)
+    )
+    ys, xs, bc_dist = ys[near], xs[near], bc_dist[near].tolist()
+    hole_tile_totals = index.cross_counts(
+        xs, ys, config.sc_check_radius, sinkhole_terrain
+    ).tolist()
+    bc_tile_totals = index.cross_counts(
+        xs, ys, config.sc_check_radius, (NEST_BC,)
+    ).tolist()
+    # Swamp tiles the nests have not taken yet, as the swamp DistanceField counts them, without the last row and
+    # column. Following the field through every swamp nest costs more than looking around each candidate, so the
+    # index rebuilds it when next asked.
+    swamp = terrain_map == SWAMP
+    swamp[-1, :] = False
+    swamp[:, -1] = False
+    index.forget((SWAMP,))
+    reach = max(config.sc_nest_max_swamp_dist, 0)
+    diamond = np.add.outer(
+        np.abs(np.arange(-reach, reach + 1)), np.abs(np.arange(-reach, reach + 1))
+    )
+    # Until an SC nest lands on a sinkhole or BC tile, the counts and sinkhole distances from before hold
+    counts_hold = True
+    for nest, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+        if counts_hold:
+            hole_tile_total = hole_tile_totals[nest]
+            bc_tile_total = bc_tile_totals[nest]
+        else:
+            if index.distance(x, y, sinkhole_terrain) > config.sc_nest_max_hole_dist:
+                continue
+            hole_tile_total = index.cross_count(
+                x, y, config.sc_check_radius, sinkhole_terrain
+            )
+            bc_tile_total = index.cross_count(x, y, config.sc_check_radius, (NEST_BC,))
+        # Earlier nests may have taken the swamp tiles this one was near
+        left, top = max(x - reach, 0), max(y - reach, 0)
+        right, bottom = min(x + reach + 1, width), min(y + reach + 1, height)
+        near_swamp = swamp[top:bottom, left:right] & (
+            diamond[
+                top - y + reach : bottom - y + reach,
+                left - x + reach : right - x + reach,
+            ]
+            < min(bc_dist[nest], reach + 1)
+        )
+        if near_swamp.any():
+            # Count the number of sinkhole tiles and BC tiles, and spawn only if there are more sinkhole tiles in
+            # the radius
+            if hole_tile_total > bc_tile_total:
+                # Spawn as special tile if it happens to be on top of a swamp
+                previous = int(terrain_map[y, x])
+                if previous == SWAMP:
+                    index.paint(x, y, NEST_SWAMP_SC)
+                    swamp[y, x] = False
+                else:
+                    index.paint(x, y, NEST_SC)
+                if (previous in sinkhole_terrain) | (previous == NEST_BC):
+                    counts_hold = False
 
     return terrain_map
 
 
-def spawn_bc_nest(terrain_map, x, y):
+def bc_extra_draws(source, xs, ys, config=default_config):
+    """The roll and direction of every extra tile the BC nests at xs, ys may grow, as lists of bc_max_nest_size
+    values per nest. Extra tile b of a nest rolls with draw 2 * b and picks its direction with draw 2 * b + 1.
+    """
+    draw = 2 * np.arange(max(config.bc_max_nest_size, 0))
+    xs, ys = xs[:, np.newaxis], ys[:, np.newaxis]
+    rolls = source.integers(
+        stage_bc_extras, 0, 11 - config.bc_nest_density, xs, ys, draw
+    )
+    directions = source.integers(stage_bc_extras, 0, 4, xs, ys, draw + 1)
+    return rolls.tolist(), directions.tolist()
+
+
+def spawn_bc_nest(terrain_map, x, y, index=None, config=default_config, rng=random):
     """Check how many sinkhole tiles and other BC nests are nearby for potential extra tiles, then spawn a nest"""
-    height = len(terrain_map)
-    width = len(terrain_map[0])
+    height, width = terrain_map.shape
+    if index is None:
+        index = TerrainIndex(terrain_map)
     # check in a XbyX radius for how many sinkhole tiles there are, and how many other BC tiles. Each BC nest takes bc_load sinkhole tiles.
-    hole_tile_total = 0
-    bc_tile_total = 0
-
-    for a in range(bc_check_radius):
-        # check upwards
-        if y - a >= 0:
-            if (terrain_map[y - a][x] == terrain_hole_core) | (
-                terrain_map[y - a][x] == terrain_hole_side
-            ):
-                hole_tile_total += 1
-            if terrain_map[y - a][x] == terrain_nest_bc:
-                bc_tile_total += 1
-        # check downwards
-        if y + a <= height - 1:
-            if (terrain_map[y + a][x] == terrain_hole_core) | (
-                terrain_map[y + a][x] == terrain_hole_side
-            ):
-                hole_tile_total += 1
-            if terrain_map[y + a][x] == terrain_nest_bc:
-                bc_tile_total += 1
-        # check rightward
-        if x + a <= width - 1:
-            if (terrain_map[y][x + a] == terrain_hole_core) | (
-                terrain_map[y][x + a] == terrain_hole_side
-            ):
-                hole_tile_total += 1
-            if terrain_map[y][x + a] == terrain_nest_bc:
-                bc_tile_total += 1
-        # check leftward
-        if x - a >= 0:
-            if (terrain_map[y][x - a] == terrain_hole_core) | (
-                terrain_map[y][x - a] == terrain_hole_side
-            ):
-                hole_tile_total += 1
-            if terrain_map[y][x - a] == terrain_nest_bc:
-                bc_tile_total += 1
-    surplus = hole_tile_total - (bc_tile_total * bc_load)
+    hole_tile_total = index.cross_count(x, y, config.bc_check_radius, sinkhole_terrain)
+    bc_tile_total = index.cross_count(x, y, config.bc_check_radius, (NEST_BC,))
+    surplus = hole_tile_total - (bc_tile_total * config.bc_load)
 
     # surplus gives a chance at extra nest tiles for each nest spawn, in a random direction
     if surplus > 0:
-        if surplus > bc_max_nest_size:
-            surplus = bc_max_nest_size
+        if surplus > config.bc_max_nest_size:
+            surplus = config.bc_max_nest_size
         for b in range(surplus):
-            if random.randint(0, 10 - bc_nest_density) == 0:
+            if rng.randint(0, 10 - config.bc_nest_density) == 0:
                 # create a tile. Arbitrarily check right, then down, then left, then up
-                random_dir = random.randint(0, 3)
+                random_dir = rng.randint(0, 3)
                 if random_dir == 0:
                     if x + b <= width - 1:
-                        if (terrain_map[y][x + b] == 0) & (
-                            distance_to_closest_sinkhole(terrain_map, x + b, y)
-                            < bc_nest_max_dist
+                        if (terrain_map[y, x + b] == SAND) & (
+                            distance_to_closest_sinkhole(terrain_map, x + b, y, index)
+                            < config.bc_nest_max_dist
                         ):
-                            terrain_map[y][x + b] = terrain_nest_bc
+                            index.paint(x + b, y, NEST_BC)
                 elif random_dir == 1:
                     if y + b <= height - 1:
-                        if (terrain_map[y + b][x] == 0) & (
-                            distance_to_closest_sinkhole(terrain_map, x, y + b)
-                            < bc_nest_max_dist
+                        if (terrain_map[y + b, x] == SAND) & (
+                            distance_to_closest_sinkhole(terrain_map, x, y + b, index)
+                            < config.bc_nest_max_dist
                         ):
-                            terrain_map[y + b][x] = terrain_nest_bc
+                            index.paint(x, y + b, NEST_BC)
                 elif random_dir == 2:
                     if x - b >= 0:
-                        if (terrain_map[y][x - b] == 0) & (
-                            distance_to_closest_sinkhole(terrain_map, x - b, y)
-                            < bc_nest_max_dist
+                        if (terrain_map[y, x - b] == SAND) & (
+                            distance_to_closest_sinkhole(terrain_map, x - b, y, index)
+                            < config.bc_nest_max_dist
                         ):
-                            terrain_map[y][x - b] = terrain_nest_bc
+                            index.paint(x - b, y, NEST_BC)
                 elif random_dir == 3:
                     if y - b >= 0:
-                        if (terrain_map[y - b][x] == 0) & (
-                            distance_to_closest_sinkhole(terrain_map, x, y - b)
-                            < bc_nest_max_dist
+                        if (terrain_map[y - b, x] == SAND) & (
+                            distance_to_closest_sinkhole(terrain_map, x, y - b, index)
+                            < config.bc_nest_max_dist
                         ):
-                            terrain_map[y - b][x] = terrain_nest_bc
+                            index.paint(x, y - b, NEST_BC)
 
     return terrain_map
 
 
-def spawn_sc_nest(terrain_map, x, y):
+def spawn_sc_nest(terrain_map, x, y, index=None, config=default_config):
     """Create SC nests where allowed"""
-    height = len(terrain_map)
-    width = len(terrain_map[0])
+    height, width = terrain_map.shape
+    if index is None:
+        index = TerrainIndex(terrain_map)
     count_exclude = 0
-    hole_tile_total = 0
-    bc_tile_total = 0
 
     # Only spawn on tiles that are closer to swamps than to BC nests
     if distance_to_closest_terrain_type(
-        terrain_map, x, y, terrain_swamp
-    ) < distance_to_closest_terrain_type(terrain_map, x, y, terrain_nest_bc):
+        terrain_map, x, y, SWAMP, index
+    ) < distance_to_closest_terrain_type(terrain_map, x, y, NEST_BC, index):
         # Count the number of sinkhole tiles and BC tiles, and spawn only if there are more sinkhole tiles in the radius
-        for a in range(sc_check_radius):
-            # check upwards
-            if y - a >= 0:
-                if (terrain_map[y - a][x] == terrain_hole_core) | (
-                    terrain_map[y - a][x] == terrain_hole_side
-                ):
-                    hole_tile_total += 1
-                if terrain_map[y - a][x] == terrain_nest_bc:
-                    bc_tile_total += 1
-            # check downwards
-            if y + a <= height - 1:
-                if (terrain_map[y + a][x] == terrain_hole_core) | (
-                    terrain_map[y + a][x] == terrain_hole_side
-                ):
-                    hole_tile_total += 1
-                if terrain_map[y + a][x] == terrain_nest_bc:
-                    bc_tile_total += 1
-            # check rightward
-            if x + a <= width - 1:
-                if (terrain_map[y][x + a] == terrain_hole_core) | (
-                    terrain_map[y][x + a] == terrain_hole_side
-                ):
-                    hole_tile_total += 1
-                if terrain_map[y][x + a] == terrain_nest_bc:
-                    bc_tile_total += 1
-            # check leftward
-            if x - a >= 0:
-                if (terrain_map[y][x - a] == terrain_hole_core) | (
-                    terrain_map[y][x - a] == terrain_hole_side
-                ):
-                    hole_tile_total += 1
-                if terrain_map[y][x - a] == terrain_nest_bc:
-                    bc_tile_total += 1
+        hole_tile_total = index.cross_count(
+            x, y, config.sc_check_radius, sinkhole_terrain
+        )
+        bc_tile_total = index.cross_count(x, y, config.sc_check_radius, (NEST_BC,))
         if hole_tile_total > bc_tile_total:
             # Spawn as special tile if it happens to be on top of a swamp
-            if terrain_map[y][x] == terrain_swamp:
-                terrain_map[y][x] = terrain_nest_swamp_sc
+            if terrain_map[y, x] == SWAMP:
+                index.paint(x, y, NEST_SWAMP_SC)
             else:
-                terrain_map[y][x] = terrain_nest_sc
+                index.paint(x, y, NEST_SC)
 
     return terrain_map
 
 
-def starve_nests(terrain_map):
+def starve_nests(terrain_map, index=None, config=default_config):
     """For each BC, check other SC and BC tiles in a given range, and starve the nest if it then exceeds a limit set by sc_feed_multiplier"""
-    height = len(terrain_map)
-    width = len(terrain_map[0])
-
-    for y in range(height):
-        for x in range(width):
-            if terrain_map[y][x] == terrain_nest_bc:
-                sc_tile_total = 0
-                bc_tile_total = 0
-                for a in range(bc_starve_range):
-                    # check upwards
-                    if y - a >= 0:
-                        if terrain_map[y - a][x] == terrain_nest_sc:
-                            sc_tile_total += 1
-                        if terrain_map[y - a][x] == terrain_nest_bc:
-                            bc_tile_total += 1
-                    # check downwards
-                    if y + a <= height - 1:
-                        if terrain_map[y + a][x] == terrain_nest_sc:
-                            sc_tile_total += 1
-                        if terrain_map[y + a][x] == terrain_nest_bc:
-                            bc_tile_total += 1
-                    # check rightward
-                    if x + a <= width - 1:
-                        if terrain_map[y][x + a] == terrain_nest_sc:
-                            sc_tile_total += 1
-                        if terrain_map[y][x + a] == terrain_nest_bc:
-                            bc_tile_total += 1
-                    # check leftward
-                    if x - a >= 0:
-                        if terrain_map[y][x - a] == terrain_nest_sc:
-                            sc_tile_total += 1
-                        if terrain_map[y][x - a] == terrain_nest_bc:
-                            bc_tile_total += 1
-                if bc_tile_total > sc_tile_total * sc_feed_multiplier:
-                    # starve the bc nest
-                    terrain_map[y][x] = terrain_nest_starved_bc
+    height, width = terrain_map.shape
+    if index is None:
+        index = TerrainIndex(terrain_map)
+
+    # Tiles only change from BC to starved as they are visited, so the BC tiles can be listed up front
+    for y, x in np.argwhere(terrain_map == NEST_BC).tolist():
+        sc_tile_total = index.cross_count(x, y, config.bc_starve_range, (NEST_SC,))
+        bc_tile_total = index.cross_count(x, y, config.bc_starve_range, (NEST_BC,))
+        if bc_tile_total > sc_tile_total * config.sc_feed_multiplier:
+            # starve the bc nest
+            index.paint(x, y, NEST_STARVED_BC)
     return terrain_map
 
 
-def distance_to_closest_sinkhole(terrain_map, tileX, tileY):
-    """"Calculate and return distance to closest sinkhole."""
-    min_dist = 99999
-    current_dist = 0
-    width = len(terrain_map[0]) - 1
-    height = len(terrain_map) - 1
-    for y in range(height):
-        for x in range(width):
-            if (terrain_map[y][x] == terrain_hole_core) | (
-                terrain_map[y][x] == terrain_hole_side
-            ):  # it's a sinkhole tile
-                current_dist = abs(tileY - y) + abs(tileX - x)
-                if current_dist < min_dist:
-                    min_dist = current_dist
-
-    return min_dist
-
-
-def distance_to_closest_terrain_type(terrain_map, tileX, tileY, terrain_type):
-    """"Calculate and return distance to closest specific terrain type."""
-    min_dist = 99999
-    current_dist = 0
-    width = len(terrain_map[0]) - 1
-    height = len(terrain_map) - 1
-    for y in range(height):
-        for x in range(width):
-            if terrain_map[y][x] == terrain_type:  # it's a sinkhole tile
-                current_dist = abs(tileY - y) + abs(tileX - x)
-                if current_dist < min_dist:
-                    min_dist = current_dist
-
-    return min_dist
+def starve_nests_batch(terrain_map, index=None, config=default_config):
+    """starve_nests for all BC tiles at once. Gives the same map as the tile-by-tile pass. The counts are taken and
+    the starved nests painted through index when one is passed."""
+    height, width = terrain_map.shape
+    # The tile-by-tile pass counts nothing, so no nest starves
+    if config.bc_starve_range <= 0:
+        return terrain_map
+    if index is None:
+        # Nothing here reads the entities, so an empty index spares listing them from the map
+        index = TerrainIndex(terrain_map, EntityIndex())
+    reach = config.bc_starve_range - 1
+    ys, xs = np.nonzero(terrain_map == NEST_BC)
+    bc_tile_total = index.cross_counts(xs, ys, config.bc_starve_range, (NEST_BC,))
+    sc_tile_total = index.cross_counts(xs, ys, config.bc_starve_range, (NEST_SC,))
+    food_limit = sc_tile_total * config.sc_feed_multiplier
+
+    # Nests that get by even with every BC tile counted are safe. For the others, a nest that starves no longer
+    # counts for the nests visited after it: those further right in its row and further down its column.
+    # Re-evaluate with the earlier starved nests discounted until nothing changes; in visiting order every nest only
+    # depends on earlier ones, so that settles on the same answer as the tile-by-tile pass.
+    hungry = bc_tile_total > food_limit
+    ys, xs = ys[hungry], xs[hungry]
+    bc_tile_total, food_limit = bc_tile_total[hungry], food_limit[hungry]
+    row_keys = ys * width + xs  # visiting order, already sorted
+    column_order = np.argsort(xs * height + ys, kind="stable")
+    column_keys = (xs * height + ys)[column_order]
+    column_lows = column_keys - np.minimum(ys[column_order], reach)
+    starved_earlier = np.empty(len(ys), dtype=np.int64)
+    starved = np.ones(len(ys), dtype=bool)
+    while True:
+        starved_earlier[column_order] = keys_in_ranges(
+            column_keys[starved[column_order]], column_lows, column_keys - 1
+        )
+        starved_earlier += keys_in_ranges(
+            row_keys[starved], row_keys - np.minimum(xs, reach), row_keys - 1
+        )
+        settled = bc_tile_total - starved_earlier > food_limit
+        if np.array_equal(settled, starved):
+            break
+        starved = settled
+
+    starved_mask = np.zeros(terrain_map.shape, dtype=bool)
+    starved_mask[ys[starved], xs[starved]] = True
+    index.paint_mask(0, 0, starved_mask, NEST_STARVED_BC)
+    return terrain_map
+
+
+def starve_stage(terrain_map, index, config, rng):
+    """The starving stage of generate_world. Starving only depends on the finished nests, so every BC tile is
+    evaluated at once. Nothing asks about BC nests after this stage, so the index stops following them rather than
+    updating their fields and counts for every nest that starves.
+    """
+    for terrain_class in [*index.fields, *index.counts]:
+        if (NEST_BC in terrain_class) | (NEST_STARVED_BC in terrain_class):
+            index.forget(terrain_class)
+    starve_nests_batch(terrain_map, index, config)
+    return terrain_map
+
+
+def cross_counts(class_mask, ys, xs, radius):
+    """TerrainIndex.cross_count of a class at many tiles at once"""
+    if radius <= 0:
+        return np.zeros(len(ys), dtype=np.int64)
+    return cross_totals(class_mask, ys, xs, radius - 1)
+
+
+def cross_totals(class_mask, ys, xs, reach):
+    """SegmentCounts.cross of a class at many tiles at once, for a cross of radius reach + 1"""
+    height, width = class_mask.shape
+    # Class tiles keyed by their position in row-major and in column-major order, so a row or column segment is a
+    # contiguous key range
+    row_keys = np.flatnonzero(class_mask)
+    column_keys = np.flatnonzero(class_mask.T)
+    row = keys_in_ranges(
+        row_keys,
+        ys * width + np.maximum(xs - reach, 0),
+        ys * width + np.minimum(xs + reach, width - 1),
+    )
+    # Column ranges are looked up in column-major order too, which keeps the searches cache friendly
+    column_order = np.argsort(xs * height + ys, kind="stable")
+    column = np.empty_like(row)
+    column[column_order] = keys_in_ranges(
+        column_keys,
+        (xs * height + np.maximum(ys - reach, 0))[column_order],
+        (xs * height + np.minimum(ys + reach, height - 1))[column_order],
+    )
+    return row + column + 2 * class_mask[ys, xs]
+
+
+def keys_in_ranges(sorted_keys, lows, highs):
+    """How many of the sorted keys fall in each range from lows to highs, both included"""
+    return np.searchsorted(sorted_keys, highs, side="right") - np.searchsorted(
+        sorted_keys, lows, side="left"
+    )
+
+
+class CounterRandom:
+    """Random draws addressed by stage, x, y and a draw number, rather than by how many came before. Every draw is a
+    hash of the seed and its address, so the draws of a tile are the same whichever tiles are drawn with it, in
+    whatever order or process, and a stage can take all of its draws as one array."""
+
+    def __init__(self, seed):
+        self.seed = seed % 2**64
+
+    def bits(self, stage, xs, ys, draw=0):
+        """64 random bits for every address, with xs, ys and draw broadcast against each other"""
+        hashed = np.uint64(self.seed)
+        with np.errstate(over="ignore"):
+            for part in (stage, xs, ys, draw):
+                # Negative coordinates wrap around to the top of the uint64 range
+                part = np.asarray(part, dtype=np.int64).astype(np.uint64)
+                hashed = mix_bits(hashed ^ (part + np.uint64(0x9E3779B97F4A7C15)))
+        return hashed
+
+    def random(self, stage, xs, ys, draw=0):
+        """A uniform float in [0, 1) for every address"""
+        return (self.bits(stage, xs, ys, draw) >> np.uint64(11)) * 2.0**-53
+
+    def integers(self, stage, low, high, xs, ys, draw=0):
+        """A whole number from low up to, not including, high for every address, like numpy's Generator.integers"""
+        low, high = np.asarray(low), np.asarray(high)
+        if np.any(high <= low):
+            raise ValueError("low >= high")
+        span = (high - low).astype(np.float64)
+        return low + (self.random(stage, xs, ys, draw) * span).astype(np.int64)
+
+    def window(self, stage, x, y, width, height, draw=0):
+        """random for every tile of a rectangle, as a height by width array"""
+        ys, xs = np.ogrid[y : y + height, x : x + width]
+        return self.random(stage, xs, ys, draw)
+
+    def tile_random(self, stage, x, y):
+        """A random.Random of its own for the draws of one stage at x, y, for code that draws as it goes"""
+        return random.Random(int(self.bits(stage, x, y)))
+
+
+def mix_bits(bits):
+    """The splitmix64 finaliser: every input bit flips about half the output bits"""
+    bits = (bits ^ (bits >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    bits = (bits ^ (bits >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return bits ^ (bits >> np.uint64(31))
+
+
+class DistanceField:
+    """Manhattan distance from every tile to the closest source tile, updated incrementally as sources come and go.
+    Sources in the last row and column are ignored, matching the scan bounds of the full-map distance helpers.
+    Distances are kept in a C int array, a few bytes a tile rather than a boxed int each.
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.dist = array.array("i", [no_distance]) * (width * height)
+
+    @classmethod
+    def from_mask(cls, source_mask):
+        """Build the field of a boolean source array in one go, using a two-pass transform per axis"""
+        height, width = source_mask.shape
+        field = cls(width, height)
+        sources = source_mask.copy()
+        sources[-1, :] = False
+        sources[:, -1] = False
+        field.dist = array.array("i", manhattan_distances(sources).tobytes())
+        return field
+
+    def distance(self, x, y):
+        return self.dist[y * self.width + x]
+
+    def neighbours(self, i):
+        x = i % self.width
+        if x > 0:
+            yield i - 1
+        if x < self.width - 1:
+            yield i + 1
+        if i >= self.width:
+            yield i - self.width
+        if i < self.width * (self.height - 1):
+            yield i + self.width
+
+    def add_source(self, x, y):
+        """Push improved distances outward from a new source until nothing improves"""
+        if (x >= self.width - 1) | (y >= self.height - 1):
+            return
+        dist = self.dist
+        source = y * self.width + x
+        if dist[source] == 0:
+            return
+        dist[source] = 0
+        queue = deque([source])
+        while queue:
+            i = queue.popleft()
+            d = dist[i] + 1
+            for n in self.neighbours(i):
+                if dist[n] > d:
+                    dist[n] = d
+                    queue.append(n)
+
+    def remove_source(self, x, y):
+        """Forget a source, then refill the tiles that took their distance from it using their remaining neighbours"""
+        if (x >= self.width - 1) | (y >= self.height - 1):
+            return
+        dist = self.dist
+        source = y * self.width + x
+        if dist[source] != 0:
+            return
+
+        # Walk outward one distance unit at a time. A tile loses its distance only when every neighbour one step
+        # closer lost theirs too; tiles with another equally close source keep their value and stop the walk.
+        affected = {source}
+        queue = deque([source])
+        while queue:
+            i = queue.popleft()
+            for n in self.neighbours(i):
+                if (n not in affected) & (dist[n] == dist[i] + 1):
+                    supported = False
+                    for m in self.neighbours(n):
+                        if (dist[m] == dist[i]) & (m not in affected):
+                            supported = True
+                            break
+                    if not supported:
+                        affected.add(n)
+                        queue.append(n)
+        for i in affected:
+            dist[i] = no_distance
+
+        # Seed every affected tile from the unaffected tiles around it, then settle them closest first
+        heap = []
+        for i in affected:
+            for n in self.neighbours(i):
+                if (n not in affected) & (dist[n] + 1 < dist[i]):
+                    dist[i] = dist[n] + 1
+            if dist[i] != no_distance:
+                heapq.heappush(heap, (dist[i], i))
+        while heap:
+            d, i = heapq.heappop(heap)
+            if d != dist[i]:
+                continue
+            for n in self.neighbours(i):
+                if dist[n] > d + 1:
+                    dist[n] = d + 1
+                    heapq.heappush(heap, (d + 1, n))
+
+
+class SpatialHash:
+    """Points bucketed on a uniform grid. Buckets are as wide as the largest distance asked about, so only the
+    3x3 buckets around a tile can hold points within reach."""
+
+    def __init__(self, bucket_size):
+        self.bucket_size = max(bucket_size, 1)
+        self.buckets = {}
+
+    def add(self, x, y):
+        key = (x // self.bucket_size, y // self.bucket_size)
+        self.buckets.setdefault(key, []).append((x, y))
+
+    def points_within(self, x, y, max_dist):
+        """Yield the points within a Manhattan distance of max_dist, at most the bucket size"""
+        bucket_x = x // self.bucket_size
+        bucket_y = y // self.bucket_size
+        for key_y in (bucket_y - 1, bucket_y, bucket_y + 1):
+            for key_x in (bucket_x - 1, bucket_x, bucket_x + 1):
+                for point_x, point_y in self.buckets.get((key_x, key_y), ()):
+                    if abs(point_x - x) + abs(point_y - y) <= max_dist:
+                        yield point_x, point_y
+
+    def any_within(self, x, y, max_dist):
+        """Whether any point lies within a Manhattan distance of max_dist, at most the bucket size"""
+        for point in self.points_within(x, y, max_dist):
+            return True
+        return False
+
+
+class EntityIndex:
+    """Placed features by kind, with the data they were placed with, bucketed on a grid for nearest, within radius
+    and count in box queries. Kinds are those of entity_kinds."""
+
+    def __init__(self, bucket_size=16):
+        self.bucket_size = max(bucket_size, 1)
+        self.data = {kind: {} for kind in entity_kinds}  # (x, y) to data, per kind
+        self.buckets = {
+            kind: {} for kind in entity_kinds
+        }  # bucket key to set of (x, y), per kind
+
+    @classmethod
+    def from_map(cls, terrain_map, bucket_size=16):
+        """The entities a terrain map shows by its tiles alone, without placement data"""
+        entities = cls(bucket_size)
+        for code, kind in terrain_entity_kinds.items():
+            ys, xs = np.nonzero(terrain_map == code)
+            for x, y in zip(xs.tolist(), ys.tolist()):
+                entities.add(kind, x, y)
+        return entities
+
+    def copy(self):
+        entities = EntityIndex(self.bucket_size)
+        entities.replace(self)
+        return entities
+
+    def replace(self, other):
+        """Take over the entities of another index, which is left as it is"""
+        for kind in entity_kinds:
+            self.data[kind] = dict(other.data[kind])
+            self.buckets[kind] = {}
+            for x, y in self.data[kind]:
+                key = (x // self.bucket_size, y // self.bucket_size)
+                self.buckets[kind].setdefault(key, set()).add((x, y))
+
+    def add(self, kind, x, y, data=None):
+        """Add an entity, or replace the data of the one already at x, y"""
+        self.data[kind][(x, y)] = data
+        key = (x // self.bucket_size, y // self.bucket_size)
+        self.buckets[kind].setdefault(key, set()).add((x, y))
+
+    def remove(self, kind, x, y):
+        if self.data[kind].pop((x, y), False) is False:
+            return
+        key = (x // self.bucket_size, y // self.bucket_size)
+        bucket = self.buckets[kind][key]
+        bucket.discard((x, y))
+        if not bucket:
+            del self.buckets[kind][key]
+
+    def repaint(self, x, y, previous, value):
+        """Follow a tile changing from one terrain code to another"""
+        if previous in terrain_entity_kinds:
+            self.remove(terrain_entity_kinds[previous], x, y)
+        if value in terrain_entity_kinds:
+            self.add(terrain_entity_kinds[value], x, y)
+
+    def get(self, kind, x, y):
+        """The data an entity was placed with"""
+        return self.data[kind][(x, y)]
+
+    def count(self, kind):
+        return len(self.data[kind])
+
+    def points(self, kind):
+        """Every entity of a kind, in map scanning order: by row, then column"""
+        return sorted(self.data[kind], key=lambda point: (point[1], point[0]))
+
+    def within(self, kind, x, y, radius):
+        """The entities within a Manhattan distance of radius, in scanning order"""
+        found = [
+            (point_x, point_y)
+            for point_x, point_y in self.in_box(
+                kind, x - radius, y - radius, x + radius, y + radius
+            )
+            if abs(point_x - x) + abs(point_y - y) <= radius
+        ]
+        return sorted(found, key=lambda point: (point[1], point[0]))
+
+    def count_in_box(self, kind, left, top, right, bottom):
+        """How many entities lie from left, top to right, bottom, both included"""
+        return sum(1 for point in self.in_box(kind, left, top, right, bottom))
+
+    def in_box(self, kind, left, top, right, bottom):
+        """Yield the entities from left, top to right, bottom, both included"""
+        size = self.bucket_size
+        buckets = self.buckets[kind]
+        columns = range(left // size, right // size + 1)
+        rows = range(top // size, bottom // size + 1)
+        # Look the box's buckets up, or go through the filled buckets if there are fewer of those
+        if len(columns) * len(rows) <= len(buckets):
+            keys = ((key_x, key_y) for key_y in rows for key_x in columns)
+        else:
+            keys = (key for key in buckets if (key[0] in columns) & (key[1] in rows))
+        for key in keys:
+            for point_x, point_y in buckets.get(key, ()):
+                if (left <= point_x <= right) & (top <= point_y <= bottom):
+                    yield point_x, point_y
+
+    def nearest(self, kind, x, y, max_dist=None):
+        """The closest entity by Manhattan distance, the first in scanning order on a tie, or None if there is none
+        within max_dist"""
+        size = self.bucket_size
+        buckets = self.buckets[kind]
+        bucket_x, bucket_y = x // size, y // size
+        best = None
+        ring = 0
+        # Search rings of buckets outwards. Points in ring r are at least (r - 1) * size + 1 away, so once the best
+        # point found is closer than that for the next ring, it is the closest
+        while (2 * ring + 1) ** 2 <= len(buckets):
+            for key_y in range(bucket_y - ring, bucket_y + ring + 1):
+                step = 1 if abs(key_y - bucket_y) == ring else 2 * ring
+                for key_x in range(bucket_x - ring, bucket_x + ring + 1, max(step, 1)):
+                    for point_x, point_y in buckets.get((key_x, key_y), ()):
+                        candidate = (
+                            abs(point_x - x) + abs(point_y - y),
+                            point_y,
+                            point_x,
+                        )
+                        if (best is None) or (candidate < best):
+                            best = candidate
+            if (best is not None) and (best[0] <= ring * size):
+                break
+            if (max_dist is not None) and (ring * size >= max_dist):
+                break
+            ring += 1
+        else:
+            # Fewer filled buckets than the next ring has, so check every point
+            for point_x, point_y in self.data[kind]:
+                candidate = (abs(point_x - x) + abs(point_y - y), point_y, point_x)
+                if (best is None) or (candidate < best):
+                    best = candidate
+        if (best is None) or ((max_dist is not None) and (best[0] > max_dist)):
+            return None
+        return best[2], best[1]
+
+
+class SegmentCounts:
+    """Running counts of one terrain class along every row and column, so any row or column segment is counted in O(1)"""
+
+    def __init__(self, class_mask):
+        height, width = class_mask.shape
+        self.width = width
+        self.height = height
+        dtype = np.min_scalar_type(max(width, height))
+        self.rows = np.zeros((height, width + 1), dtype=dtype)
+        np.cumsum(class_mask, axis=1, dtype=dtype, out=self.rows[:, 1:])
+        self.columns = np.zeros((height + 1, width), dtype=dtype)
+        np.cumsum(class_mask, axis=0, dtype=dtype, out=self.columns[1:, :])
+
+    def row(self, y, x_from, x_to):
+        """Count in row y from x_from to x_to, both included"""
+        return self.rows.item(y, x_to + 1) - self.rows.item(y, x_from)
+
+    def column(self, x, y_from, y_to):
+        """Count in column x from y_from to y_to, both included"""
+        return self.columns.item(y_to + 1, x) - self.columns.item(y_from, x)
+
+    def cross(self, x, y, radius):
+        """Count the way the nest stages walk a cross of a radius: radius - 1 tiles out along the row and column
+        in each direction, with the centre tile counted once per direction"""
+        if radius <= 0:
+            return 0
+        reach = radius - 1
+        row = self.row(y, max(x - reach, 0), min(x + reach, self.width - 1))
+        column = self.column(x, max(y - reach, 0), min(y + reach, self.height - 1))
+        return row + column + 2 * self.row(y, x, x)
+
+    def add(self, x, y, delta):
+        """Point update: delta tiles of the class at x, y"""
+        if delta > 0:
+            self.rows[y, x + 1 :] += delta
+            self.columns[y + 1 :, x] += delta
+        else:
+            self.rows[y, x + 1 :] -= -delta
+            self.columns[y + 1 :, x] -= -delta
+
+
+class TerrainIndex:
+    """Distance fields and segment counts per terrain class of a terrain map, each built on first query, and the
+    EntityIndex of the map, all kept in sync by paint()"""
+
+    def __init__(self, terrain_map, entities=None):
+        self.terrain_map = terrain_map
+        self.height, self.width = terrain_map.shape
+        self.fields = {}
+        self.counts = {}
+        if entities is None:
+            entities = EntityIndex.from_map(terrain_map)
+        self.entities = entities
+        # sinkhole_adjacent(x, y) of this map. A partial rather than a method, which would cost the per-tile
+        # loops an extra call
+        self.sinkhole_adjacent = functools.partial(sinkhole_adjacent, terrain_map)
+
+    def field(self, terrain_class):
+        """The DistanceField of a tuple of terrain codes, built from the whole map the first time it is needed"""
+        field = self.fields.get(terrain_class)
+        if field is None:
+            field = DistanceField.from_mask(np.isin(self.terrain_map, terrain_class))
+            self.fields[terrain_class] = field
+        return field
+
+    def forget(self, terrain_class):
+        """Stop following a terrain class as tiles are painted. Its field and counts are rebuilt from the map the
+        next time they are queried."""
+        self.fields.pop(terrain_class, None)
+        self.counts.pop(terrain_class, None)
+
+    def segment_counts(self, terrain_class):
+        """The SegmentCounts of a tuple of terrain codes, built from the whole map the first time it is needed"""
+        counts = self.counts.get(terrain_class)
+        if counts is None:
+            counts = SegmentCounts(np.isin(self.terrain_map, terrain_class))
+            self.counts[terrain_class] = counts
+        return counts
+
+    def distance(self, x, y, terrain_class):
+        return self.field(terrain_class).distance(x, y)
+
+    def cross_count(self, x, y, radius, terrain_class):
+        return self.segment_counts(terrain_class).cross(x, y, radius)
+
+    def distances(self, xs, ys, terrain_class):
+        """distance() at many tiles at once, as an int array"""
+        dist = np.frombuffer(self.field(terrain_class).dist, dtype=np.intc)
+        return dist[ys * self.width + xs]
+
+    def cross_counts(self, xs, ys, radius, terrain_class):
+        """cross_count() at many tiles at once, as an int array"""
+        return cross_counts(np.isin(self.terrain_map, terrain_class), ys, xs, radius)
+
+    def sinkhole_adjacent_tiles(self, xs, ys):
+        """sinkhole_adjacent() at many tiles at once, as a bool array. Leaves out the check of the tile to the west,
+        see sinkhole_adjacent_tiles."""
+        holes = np.isin(self.terrain_map, sinkhole_terrain)
+        return sinkhole_adjacent_tiles(holes, xs, ys)
+
+    def paint_mask(self, left, top, mask, value):
+        """Set every tile under a boolean mask whose top left corner sits at left, top"""
+        if self.fields or self.counts:
+            for y, x in np.argwhere(mask).tolist():
+                self.paint(left + x, top + y, value)
+        else:
+            height, width = mask.shape
+            region = self.terrain_map[top : top + height, left : left + width]
+            if value in terrain_entity_kinds:
+                changed = mask & (region != value)
+            else:
+                changed = mask & np.isin(region, tuple(terrain_entity_kinds))
+            for y, x in np.argwhere(changed).tolist():
+                self.entities.repaint(left + x, top + y, int(region[y, x]), value)
+            region[mask] = value
+
+    def paint(self, x, y, value):
+        """Set a tile and update every field and count whose terrain class it enters or leaves"""
+        previous = int(self.terrain_map[y, x])
+        self.terrain_map[y, x] = value
+        if previous == value:
+            return
+        if (previous in terrain_entity_kinds) | (value in terrain_entity_kinds):
+            self.entities.repaint(x, y, previous, value)
+        for terrain_class, field in self.fields.items():
+            if previous in terrain_class:
+                if value not in terrain_class:
+                    field.remove_source(x, y)
+            elif value in terrain_class:
+                field.add_source(x, y)
+        for terrain_class, counts in self.counts.items():
+            if previous in terrain_class:
+                if value not in terrain_class:
+                    counts.add(x, y, -1)
+            elif value in terrain_class:
+                counts.add(x, y, 1)
+
+
+def manhattan_distances(source_mask):
+    """Manhattan distance from every tile to the closest True tile of a boolean array, no_distance if there is none"""
+    height, width = source_mask.shape
+    dist = np.where(source_mask, 0, no_distance).astype(np.intc)
+    # Manhattan distance is separable: a forward and a backward running minimum along rows, then columns
+    for axis, size in ((1, width), (0, height)):
+        steps = np.arange(size, dtype=np.intc).reshape(
+            (1, size) if axis == 1 else (size, 1)
+        )
+        forward = np.minimum.accumulate(dist - steps, axis=axis) + steps
+        backward = np.flip(
+            np.minimum.accumulate(np.flip(dist + steps, axis), axis=axis), axis
+        )
+        dist = np.minimum(forward, backward - steps)
+    return dist
+
+
+def sinkhole_adjacent_tiles(holes, xs, ys):
+    """sinkhole_adjacent at the tiles xs, ys at once, given where the sinkhole tiles are. Leaves out the check of the
+    tile to the west, which compares against the tile to the north as well and so depends on more than sinkholes.
+    """
+    height, width = holes.shape
+    # Neighbours are looked up the way the per-tile checks index them, with -1 wrapping around to the far side
+    neighbour_conditions = (
+        ((-1, -1), (ys != 0) & (xs != 0)),
+        ((-1, 0), ys != 0),
+        ((-1, 1), (ys != 0) & (xs <= width - 2)),
+        ((0, 1), xs <= width - 2),
+        ((1, 1), (ys <= height - 2) & (xs <= width - 2)),
+        ((1, 0), ys <= height - 2),
+        ((1, -1), (ys <= height - 2) & (xs <= 0)),
+        ((1, -1), (ys <= height - 2) & (xs != 0)),
+    )
+    blocked = np.zeros(np.broadcast(xs, ys).shape, dtype=bool)
+    for (dy, dx), condition in neighbour_conditions:
+        blocked |= condition & holes[(ys + dy) % height, (xs + dx) % width]
+    return blocked
+
+
+def distance_to_closest_sinkhole(terrain_map, tileX, tileY, index=None):
+    """ "Calculate and return distance to closest sinkhole. Looked up in O(1) when the map's TerrainIndex is passed."""
+    if index is not None:
+        return index.distance(tileX, tileY, sinkhole_terrain)
+    return closest_distance(terrain_map, tileX, tileY, sinkhole_terrain)
+
+
+def distance_to_closest_terrain_type(
+    terrain_map, tileX, tileY, terrain_type, index=None
+):
+    """ "Calculate and return distance to closest specific terrain type. Looked up in O(1) when the map's TerrainIndex is passed."""
+    if index is not None:
+        return index.distance(tileX, tileY, (terrain_type,))
+    return closest_distance(terrain_map, tileX, tileY, (terrain_type,))
+
+
+def closest_distance(terrain_map, tileX, tileY, terrain_class):
+    """Full-map scan for the distance to the closest tile of a terrain class. The last row and column are not scanned."""
+    ys, xs = np.nonzero(np.isin(terrain_map[:-1, :-1], terrain_class))
+    if len(xs) == 0:
+        return no_distance
+    return int((np.abs(ys - tileY) + np.abs(xs - tileX)).min())
 
 
 def sinkhole_adjacent(terrain_map, x, y):
-    """"Returns true if any sinkhole tiles are directly adjacent, includes diagonal"""
+    """ "Returns true if any sinkhole tiles are directly adjacent, includes diagonal"""
     sinkhole_nearby = False
-    bound_lo = terrain_hole_core
-    bound_hi = terrain_hole_side
-    width = len(terrain_map[0]) - 1
-    height = len(terrain_map) - 1
+    bound_lo = HOLE_CORE
+    bound_hi = HOLE_SIDE
+    height, width = terrain_map.shape
+    width -= 1
+    height -= 1
 
     if y != 0:  # check row above
         if x != 0:
-            if (terrain_map[y - 1][x - 1] >= bound_lo) & (
-                terrain_map[y - 1][x - 1] <= bound_hi
+            if (terrain_map[y - 1, x - 1] >= bound_lo) & (
+                terrain_map[y - 1, x - 1] <= bound_hi
             ):
                 sinkhole_nearby = True
-        if (terrain_map[y - 1][x] >= bound_lo) & (terrain_map[y - 1][x] <= bound_hi):
+        if (terrain_map[y - 1, x] >= bound_lo) & (terrain_map[y - 1, x] <= bound_hi):
             sinkhole_nearby = True
         if x <= width - 1:
-            if (terrain_map[y - 1][x + 1] >= bound_lo) & (
-                terrain_map[y - 1][x + 1] <= bound_hi
+            if (terrain_map[y - 1, x + 1] >= bound_lo) & (
+                terrain_map[y - 1, x + 1] <= bound_hi
             ):
                 sinkhole_nearby = True
 
     if x <= width - 1:  # check column at right side
         if y != 0:
-            if (terrain_map[y - 1][x + 1] >= bound_lo) & (
-                terrain_map[y - 1][x + 1] <= bound_hi
+            if (terrain_map[y - 1, x + 1] >= bound_lo) & (
+                terrain_map[y - 1, x + 1] <= bound_hi
             ):
                 sinkhole_nearby = True
-        if (terrain_map[y][x + 1] >= bound_lo) & (terrain_map[y][x + 1] <= bound_hi):
+        if (terrain_map[y, x + 1] >= bound_lo) & (terrain_map[y, x + 1] <= bound_hi):
             sinkhole_nearby = True
         if y <= height - 1:
-            if (terrain_map[y + 1][x + 1] >= bound_lo) & (
-                terrain_map[y + 1][x + 1] <= bound_hi
+            if (terrain_map[y + 1, x + 1] >= bound_lo) & (
+                terrain_map[y + 1, x + 1] <= bound_hi
             ):
                 sinkhole_nearby = True
 
     if y <= height - 1:  # check row below
         if x <= 0:
-            if (terrain_map[y + 1][x - 1] >= bound_lo) & (
-                terrain_map[y + 1][x - 1] <= bound_hi
+            if (terrain_map[y + 1, x - 1] >= bound_lo) & (
+                terrain_map[y + 1, x - 1] <= bound_hi
             ):
                 sinkhole_nearby = True
-        if (terrain_map[y + 1][x] >= bound_lo) & (terrain_map[y + 1][x] <= bound_hi):
+        if (terrain_map[y + 1, x] >= bound_lo) & (terrain_map[y + 1, x] <= bound_hi):
             sinkhole_nearby = True
         if x <= width - 1:
-            if (terrain_map[y + 1][x + 1] >= bound_lo) & (
-                terrain_map[y + 1][x + 1] <= bound_hi
+            if (terrain_map[y + 1, x + 1] >= bound_lo) & (
+                terrain_map[y + 1, x + 1] <= bound_hi
             ):
                 sinkhole_nearby = True
 
     if x != 0:  # check column at left side
         if y != 0:
-            if (terrain_map[y - 1][x - 1] >= bound_lo) & (
-                terrain_map[y - 1][x - 1] <= bound_hi
+            if (terrain_map[y - 1, x - 1] >= bound_lo) & (
+                terrain_map[y - 1, x - 1] <= bound_hi
             ):
                 sinkhole_nearby = True
-        if (terrain_map[y][x - 1] >= bound_lo) & (terrain_map[y - 1][x] <= bound_hi):
+        if (terrain_map[y, x - 1] >= bound_lo) & (terrain_map[y - 1, x] <= bound_hi):
             sinkhole_nearby = True
         if y <= height - 1:
-            if (terrain_map[y + 1][x - 1] >= bound_lo) & (
-                terrain_map[y + 1][x - 1] <= bound_hi
+            if (terrain_map[y + 1, x - 1] >= bound_lo) & (
+                terrain_map[y + 1, x - 1] <= bound_hi
             ):
                 sinkhole_nearby = True
 
@@ -0,0 +1,146 @@
+"""Per-stage instrumentation of generate_world.
+
+Pass a GenerationProfile as generate_world(profile=...) to record, for every stage, its wall time, how many tiles it
+wrote and changed, and how many distance, neighbourhood and sinkhole adjacency queries it made. A query made for many
+tiles at once counts once per tile. The queries are counted by a TerrainIndex subclass that only exists while
+profiling, so unprofiled runs pay nothing for it. The results come out as a report or as Chrome trace JSON, for
+chrome://tracing or Perfetto.
+"""
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import Counter, namedtuple
+
+import numpy as np
+
+from map_generator import Terrain, TerrainIndex, sinkhole_terrain
+
+StageRecord = namedtuple("StageRecord", "name start seconds counts")
+
+
+class GenerationProfile:
+    """Timings and counts of the stages of one or more generate_world runs"""
+
+    def __init__(self):
+        self.records = []
+        self.counts = Counter()  # of the stage running now
+        self.origin = time.perf_counter()
+
+    def index(self, terrain_map, entities=None):
+        """The TerrainIndex generate_world should use, counting its queries and writes into this profile"""
+        return CountingTerrainIndex(terrain_map, self, entities)
+
+    @contextlib.contextmanager
+    def stage(self, name, terrain_map):
+        """Time a stage and collect the counts made while it runs"""
+        before = terrain_map.copy()
+        self.counts = Counter()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            # Stages that paint through the index count their writes there; tiles changed is counted for all
+            self.counts["tiles_changed"] = int(np.count_nonzero(before != terrain_map))
+            self.records.append(
+                StageRecord(name, start - self.origin, seconds, dict(self.counts))
+            )
+            self.counts = Counter()
+
+    def count(self, name, amount=1):
+        self.counts[name] += amount
+
+    def report(self):
+        """The records as plain data: one entry per stage run, and totals per stage name"""
+        totals = {}
+        for record in self.records:
+            total = totals.setdefault(
+                record.name, {"seconds": 0.0, "runs": 0, "counts": Counter()}
+            )
+            total["seconds"] += record.seconds
+            total["runs"] += 1
+            total["counts"].update(record.counts)
+        for total in totals.values():
+            total["counts"] = dict(total["counts"])
+        return {
+            "stages": [record._asdict() for record in self.records],
+            "totals": totals,
+        }
+
+    def chrome_trace(self):
+        """The records as Chrome trace events: a span per stage with its counts as arguments"""
+        process_id = os.getpid()
+        thread_id = threading.get_ident()
+        events = [
+            {
+                "name": record.name,
+                "cat": "generate_world",
+                "ph": "X",
+                "ts": record.start * 1e6,
+                "dur": record.seconds * 1e6,
+                "pid": process_id,
+                "tid": thread_id,
+                "args": record.counts,
+            }
+            for record in self.records
+        ]
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write_chrome_trace(self, path):
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file)
+
+
+class CountingTerrainIndex(TerrainIndex):
+    """A TerrainIndex that counts its queries and tile writes into a GenerationProfile"""
+
+    def __init__(self, terrain_map, profile, entities=None):
+        super().__init__(terrain_map, entities)
+        self.profile = profile
+        adjacent = self.sinkhole_adjacent
+
+        def counted_sinkhole_adjacent(x, y):
+            profile.counts["sinkhole_adjacent"] += 1
+            return adjacent(x, y)
+
+        self.sinkhole_adjacent = counted_sinkhole_adjacent
+
+    def distance(self, x, y, terrain_class):
+        self.profile.counts[query_name("distance_to", terrain_class)] += 1
+        return super().distance(x, y, terrain_class)
+
+    def cross_count(self, x, y, radius, terrain_class):
+        self.profile.counts[query_name("cross_count", terrain_class)] += 1
+        return super().cross_count(x, y, radius, terrain_class)
+
+    def distances(self, xs, ys, terrain_class):
+        self.profile.counts[query_name("distance_to", terrain_class)] += len(xs)
+        return super().distances(xs, ys, terrain_class)
+
+    def cross_counts(self, xs, ys, radius, terrain_class):
+        self.profile.counts[query_name("cross_count", terrain_class)] += len(xs)
+        return super().cross_counts(xs, ys, radius, terrain_class)
+
+    def sinkhole_adjacent_tiles(self, xs, ys):
+        self.profile.counts["sinkhole_adjacent"] += len(xs)
+        return super().sinkhole_adjacent_tiles(xs, ys)
+
+    def paint_mask(self, left, top, mask, value):
+        # Once fields or counts are built, the mask is painted tile by tile through paint(), which counts itself
+        if not (self.fields or self.counts):
+            self.profile.counts["tile_writes"] += int(np.count_nonzero(mask))
+        super().paint_mask(left, top, mask, value)
+
+    def paint(self, x, y, value):
+        self.profile.counts["tile_writes"] += 1
+        super().paint(x, y, value)
+
+
+def query_name(query, terrain_class):
+    """Counter name of a query against a tuple of terrain codes, like distance_to_sinkhole"""
+    if terrain_class == sinkhole_terrain:
+        return f"{query}_sinkhole"
+    return f"{query}_" + "_".join(Terrain(code).name.lower() for code in terrain_class)
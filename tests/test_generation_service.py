@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures.process import BrokenProcessPool
+
+import pytest
+
+from generation_service import GenerationService, ServiceBusy
+
+
+async def render_all(service, seeds):
+    """Ask for small worlds of every seed at once, returning each result or the error it raised"""
+    return await asyncio.gather(
+        *(service.render("world", seed, 20, 10) for seed in seeds),
+        return_exceptions=True,
+    )
+
+
+@pytest.mark.parametrize("workers, max_queued", [(2, 0), (2, 1), (3, 2)])
+def test_jobs_up_to_workers_and_queue_are_admitted(workers, max_queued):
+    async def check():
+        service = GenerationService(workers, max_queued)
+        try:
+            admitted = workers + max_queued
+            results = await render_all(service, range(admitted + 2))
+        finally:
+            service.close()
+        assert all(isinstance(result, bytes) for result in results[:admitted])
+        assert all(isinstance(result, ServiceBusy) for result in results[admitted:])
+        assert service.stats.rejected == 2
+        assert service.active == 0
+
+    asyncio.run(check())
+
+
+def test_requests_for_one_world_share_a_job():
+    async def check():
+        service = GenerationService(1, 0)
+        try:
+            results = await asyncio.gather(
+                *(service.render("png", 4, 20, 10) for _ in range(5))
+            )
+        finally:
+            service.close()
+        assert len(set(results)) == 1
+        assert (service.stats.jobs, service.stats.coalesced) == (1, 4)
+
+    asyncio.run(check())
+
+
+def test_a_dead_worker_only_fails_its_own_jobs():
+    async def check():
+        service = GenerationService(2, 4)
+        try:
+            await render_all(service, [0, 1])
+            job = asyncio.ensure_future(service.render("world", 2, 400, 400))
+            await asyncio.sleep(0.2)
+            for process in list(service.pool._processes.values()):
+                process.kill()
+            with pytest.raises(BrokenProcessPool):
+                await job
+            results = await render_all(service, range(3, 9))
+        finally:
+            service.close()
+        assert all(isinstance(result, bytes) for result in results)
+        assert service.stats.pool_restarts == 1
+        assert service.active == 0
+
+    asyncio.run(check())
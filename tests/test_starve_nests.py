@@ -0,0 +1,49 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from map_generator import (
+    NEST_BC,
+    NEST_SC,
+    NEST_STARVED_BC,
+    SAND,
+    default_config,
+    starve_nests,
+    starve_nests_batch,
+)
+
+
+def random_map(rng, width, height):
+    """Sand with BC and SC nest tiles scattered over it, dense enough for nests to starve each other out"""
+    terrain_map = np.full((height, width), SAND, dtype=np.uint8)
+    roll = rng.random((height, width))
+    terrain_map[roll < 0.15] = NEST_BC
+    terrain_map[(roll >= 0.15) & (roll < 0.18)] = NEST_SC
+    return terrain_map
+
+
+@pytest.mark.parametrize("seed", range(12))
+@pytest.mark.parametrize("starve_range", [-2, 0, 1, 3, 8, 30])
+@pytest.mark.parametrize("feed_multiplier", [0, 1, 4])
+def test_batch_matches_tile_by_tile(seed, starve_range, feed_multiplier):
+    rng = np.random.default_rng(seed)
+    width, height = rng.integers(1, 60, size=2)
+    terrain_map = random_map(rng, width, height)
+    config = replace(
+        default_config,
+        bc_starve_range=starve_range,
+        sc_feed_multiplier=feed_multiplier,
+    )
+
+    expected = starve_nests(terrain_map.copy(), config=config)
+    batch = starve_nests_batch(terrain_map.copy(), config=config)
+    assert np.array_equal(batch, expected)
+
+
+def test_nothing_starves_without_range():
+    terrain_map = random_map(np.random.default_rng(0), 40, 30)
+    config = replace(default_config, bc_starve_range=0)
+    batch = starve_nests_batch(terrain_map.copy(), config=config)
+    assert not (batch == NEST_STARVED_BC).any()
+    assert np.array_equal(batch, terrain_map)
@@ -0,0 +1,21 @@
+import numpy as np
+
+import tile_server
+from tile_server import TilePyramid, majority_downsample, tile_size
+from world_chunks import generate_region
+
+
+def test_wide_tiles_generate_bounded_regions(monkeypatch):
+    sizes = []
+
+    def recording_generate_region(world_seed, x, y, width, height, config):
+        sizes.append((width, height))
+        return generate_region(world_seed, x, y, width, height, config)
+
+    monkeypatch.setattr(tile_server, "generate_region", recording_generate_region)
+    monkeypatch.setattr(tile_server, "max_region_side", tile_size)
+    pyramid = TilePyramid(3)
+    codes = pyramid.tile(1, -1, 0)
+    assert sizes == [(tile_size, tile_size)] * 4
+    world = generate_region(3, -2 * tile_size, 0, 2 * tile_size, 2 * tile_size)
+    np.testing.assert_array_equal(codes, majority_downsample(world))
@@ -0,0 +1,35 @@
+import os
+
+import numpy as np
+import pytest
+
+from world_cache import WorldCache, partial_prefix
+
+
+def test_partial_entries_are_not_counted(tmp_path):
+    (tmp_path / f"{partial_prefix}abc.npz").write_bytes(b"x" * 1000)
+    (tmp_path / "done.npz").write_bytes(b"x" * 10)
+    cache = WorldCache(tmp_path)
+    assert dict(cache.entries) == {"done.npz": 10}
+    assert cache.total_bytes == 10
+
+
+def test_failed_write_leaves_nothing_behind(tmp_path):
+    cache = WorldCache(tmp_path)
+
+    def save(path):
+        np.savez_compressed(path, terrain_map=np.zeros((2, 2), dtype=np.uint8))
+        os.remove(path)
+        raise OSError("disk full")
+
+    with pytest.raises(OSError, match="disk full"):
+        cache.write("entry.npz", save)
+    assert os.listdir(tmp_path) == []
+    assert cache.total_bytes == 0
+
+
+def test_written_entries_keep_their_name(tmp_path):
+    cache = WorldCache(tmp_path, max_bytes=0)
+    terrain_map = cache.world(3, 20, 10)
+    assert os.listdir(tmp_path) == [next(iter(cache.entries))]
+    np.testing.assert_array_equal(WorldCache(tmp_path).world(3, 20, 10), terrain_map)
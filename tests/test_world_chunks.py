@@ -0,0 +1,73 @@
+from dataclasses import replace
+
+import numpy as np
+import pytest
+
+from map_generator import default_config
+from world_chunks import (
+    chunk_size,
+    generate_chunk,
+    generate_region,
+    generate_region_parallel,
+    stage_margins,
+)
+
+# Many small swamps, so they come in every size bonus around the sinkholes and the regions stay quick to generate
+dense_config = replace(
+    default_config,
+    swamp_density=950,
+    swamp_min_size=1,
+    swamp_max_size=2,
+    swamp_min_arm=1,
+    swamp_max_arm=3,
+)
+
+
+@pytest.mark.parametrize("seed", [1, 7])
+@pytest.mark.parametrize(
+    "config",
+    [
+        default_config,
+        dense_config,
+        # A swamp_max_bonus below the fixed bonus of 8 must not shrink the halo
+        replace(dense_config, swamp_max_bonus=1),
+    ],
+)
+def test_regions_agree_where_they_overlap(seed, config):
+    region = generate_region(seed, -100, -80, 200, 160, config)
+    for x, y, width, height in [
+        (-37, -80, 90, 70),
+        (0, 0, 100, 80),
+        (-100, 13, 61, 67),
+    ]:
+        part = generate_region(seed, x, y, width, height, config)
+        np.testing.assert_array_equal(
+            part, region[y + 80 : y + 80 + height, x + 100 : x + 100 + width]
+        )
+
+
+def test_chunks_tile_the_world():
+    chunks = [[generate_chunk(3, cx, cy) for cx in (-1, 0)] for cy in (-1, 0)]
+    region = generate_region(
+        3, -chunk_size, -chunk_size, 2 * chunk_size, 2 * chunk_size
+    )
+    np.testing.assert_array_equal(np.block(chunks), region)
+
+
+@pytest.mark.parametrize("workers", [1, 3])
+def test_parallel_matches_for_any_worker_count(workers):
+    expected = generate_region(5, -30, 20, 150, 110, dense_config)
+    terrain_map = generate_region_parallel(
+        5, -30, 20, 150, 110, workers=workers, tile_size=64, config=dense_config
+    )
+    np.testing.assert_array_equal(terrain_map, expected)
+
+
+@pytest.mark.parametrize("max_bonus", [1, 5, 8])
+def test_swamp_margin_covers_the_fixed_bonus(max_bonus):
+    # Swamps in the band short of the sinkhole-side one always get a bonus of 8
+    config = replace(dense_config, swamp_max_bonus=max_bonus)
+    assert (
+        stage_margins(config)[1]
+        == stage_margins(replace(dense_config, swamp_max_bonus=8))[1]
+    )
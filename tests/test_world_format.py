@@ -0,0 +1,52 @@
+import random
+
+import numpy as np
+import pytest
+
+from map_generator import SAND, generate_world
+from world_format import open_world, save_world, world_entities
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip_with_empty_entity_lists(tmp_path, compress):
+    # A small world has no BC or SC nests
+    terrain_map = generate_world(10, 10, rng=random.Random(0))
+    entities = world_entities(terrain_map)
+    assert len(entities["bc_nests"]) == 0
+    path = tmp_path / "small.world"
+    save_world(path, terrain_map, seed=0, compress=compress, chunk_size=4)
+
+    with open_world(path) as world:
+        assert np.array_equal(world.terrain_map(), terrain_map)
+        assert np.array_equal(world.region(3, 2, 5, 6), terrain_map[2:8, 3:8])
+        for name, rows in entities.items():
+            assert world.entity(name).shape == rows.shape
+            assert np.array_equal(world.entity(name), rows)
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_round_trip_without_any_entities(tmp_path, compress):
+    terrain_map = np.full((3, 3), SAND, dtype=np.uint8)
+    path = tmp_path / "sand.world"
+    save_world(path, terrain_map, compress=compress)
+
+    with open_world(path) as world:
+        assert np.array_equal(world.terrain_map(), terrain_map)
+        for name in world.entity_names:
+            assert world.entity(name).shape == (0, 2)
+
+
+def test_empty_and_flat_entity_lists_keep_their_columns(tmp_path):
+    terrain_map = np.full((4, 5), SAND, dtype=np.uint8)
+    entities = {
+        "nothing": np.zeros((0, 3), dtype=np.int32),
+        "flat": [4, 7, 9],
+        "empty_flat": [],
+    }
+    path = tmp_path / "custom.world"
+    save_world(path, terrain_map, entities=entities)
+
+    with open_world(path) as world:
+        assert world.entity("nothing").shape == (0, 3)
+        assert world.entity("flat").tolist() == [[4], [7], [9]]
+        assert world.entity("empty_flat").shape == (0, 1)
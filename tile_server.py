@@ -0,0 +1,294 @@
+"""Serve an unbounded Corrinthea world over HTTP as a pyramid of PNG tiles, for viewers that pan and zoom.
+
+Level 0 shows one pixel per world tile, and every level above halves the resolution, each pixel taking the terrain
+most of the 2x2 pixels below it have. Tiles are rendered the first time they are asked for, from world_chunks chunks
+that are generated as they are needed, and everything is kept in memory with least recently used eviction.
+
+    python tile_server.py --seed 7 --port 8000
+
+serves tile x, y of a level at http://localhost:8000/{level}/{x}/{y}.png, x and y counting tile_size tiles of that
+level from the world origin, negative ones included.
+"""
+
+import argparse
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from map_generator import Terrain, default_config, encode_png
+from world_cache import CacheStats
+from world_chunks import chunk_size, generate_region
+
+tile_size = 256  # pixels along each side of a tile, at every level
+max_level = 4  # coarsest level served, a tile of which covers 2**max_level * tile_size world tiles a side
+max_region_side = 1024  # widest region of chunks generated in one go. Memory grows with its square, and the
+# halo every region repeats costs less the wider it is
+
+tile_path = re.compile(r"/(\d+)/(-?\d+)/(-?\d+)\.png")
+
+
+class LRUCache:
+    """A dict of at most max_items entries that drops the least recently used one to make room"""
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.stats = CacheStats()
+
+    def get(self, key):
+        """The value stored under key, or None"""
+        value = self.items.get(key)
+        if value is None:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+            self.items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        self.stats.writes += 1
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+            self.stats.evictions += 1
+
+
+class TilePyramid:
+    """The tiles of a chunked world at every level up to max_level, as terrain codes and as PNG images. Chunks,
+    code tiles and images each have their own LRUCache. The chunk cache should hold the chunks of a
+    max_region_side square, or rendering a tile that wide generates some of its chunks twice. Safe to use from
+    many threads: the caches are only locked while they are read or written, and a thread that wants something
+    another thread is building waits for it rather than building it again."""
+
+    def __init__(
+        self,
+        world_seed,
+        config=default_config,
+        levels=max_level,
+        max_chunks=2048,
+        max_tiles=1024,
+    ):
+        self.world_seed = world_seed
+        self.config = config
+        self.levels = levels
+        self.chunks = LRUCache(max_chunks)
+        self.tiles = LRUCache(max_tiles)
+        self.images = LRUCache(max_tiles)
+        # The caches and the futures of what is being built are shared by the server's request threads
+        self.lock = threading.Lock()
+        self.building = {}  # futures by cache name and key
+
+    def image(self, level, x, y):
+        """PNG bytes of tile x, y of a level"""
+        if not 0 <= level <= self.levels:
+            raise ValueError(f"level {level} is outside 0 to {self.levels}")
+        return self.cached(
+            "images", (level, x, y), lambda: encode_png(self.tile(level, x, y))
+        )
+
+    def tile(self, level, x, y):
+        """Terrain codes of tile x, y of a level, a tile_size square uint8 array"""
+        return self.cached("tiles", (level, x, y), lambda: self.build_tile(level, x, y))
+
+    def cached(self, name, key, build):
+        """The value under key in the cache of that name, built and stored if it is missing"""
+        cache = getattr(self, name)
+        with self.lock:
+            value = cache.get(key)
+            if value is not None:
+                return value
+            future = self.building.get((name, key))
+            if future is None:
+                future = Future()
+                self.building[name, key] = future
+                owner = True
+            else:
+                owner = False
+        if not owner:
+            return future.result()
+        try:
+            value = build()
+        except BaseException as error:
+            with self.lock:
+                del self.building[name, key]
+            future.set_exception(error)
+            raise
+        with self.lock:
+            cache.put(key, value)
+            del self.building[name, key]
+        future.set_result(value)
+        return value
+
+    def build_tile(self, level, x, y):
+        span = tile_size << level  # world tiles along each side of the tile
+        if level == 0:
+            codes = self.region(x * span, y * span, span, span)
+        else:
+            # Generate every missing chunk under the tile in one go, so they share one halo. Wider tiles leave it to
+            # their children
+            if span <= max_region_side:
+                self.generate_chunks(x * span, y * span, span, span)
+            below = np.empty((2 * tile_size, 2 * tile_size), dtype=np.uint8)
+            for dy in range(2):
+                for dx in range(2):
+                    below[
+                        dy * tile_size : (dy + 1) * tile_size,
+                        dx * tile_size : (dx + 1) * tile_size,
+                    ] = self.tile(level - 1, 2 * x + dx, 2 * y + dy)
+            codes = majority_downsample(below)
+        return codes
+
+    def region(self, x, y, width, height):
+        """The world tiles from x, y to x + width - 1, y + height - 1, put together from cached chunks"""
+        chunks = self.generate_chunks(x, y, width, height)
+        region = np.empty((height, width), dtype=np.uint8)
+        for (cx, cy), chunk in chunks.items():
+            top, left = max(y, cy * chunk_size), max(x, cx * chunk_size)
+            bottom = min(y + height, (cy + 1) * chunk_size)
+            right = min(x + width, (cx + 1) * chunk_size)
+            region[top - y : bottom - y, left - x : right - x] = chunk[
+                top - cy * chunk_size : bottom - cy * chunk_size,
+                left - cx * chunk_size : right - cx * chunk_size,
+            ]
+        return region
+
+    def generate_chunks(self, x, y, width, height):
+        """Generate the chunks under a world rectangle that are neither cached nor being generated by another
+        thread, as one region spanning all of them. Returns every chunk under the rectangle by chunk coordinates.
+        """
+        chunks = {}
+        waiting = {}
+        missing = []
+        with self.lock:
+            for cy in range(y // chunk_size, (y + height - 1) // chunk_size + 1):
+                for cx in range(x // chunk_size, (x + width - 1) // chunk_size + 1):
+                    chunk = self.chunks.get((cx, cy))
+                    future = self.building.get(("chunks", (cx, cy)))
+                    if chunk is not None:
+                        chunks[cx, cy] = chunk
+                    elif future is not None:
+                        waiting[cx, cy] = future
+                    else:
+                        self.building["chunks", (cx, cy)] = Future()
+                        missing.append((cx, cy))
+        if missing:
+            try:
+                self.generate_missing(missing, chunks)
+            except BaseException as error:
+                with self.lock:
+                    futures = [self.building.pop(("chunks", key)) for key in missing]
+                for future in futures:
+                    future.set_exception(error)
+                raise
+        for key, future in waiting.items():
+            chunks[key] = future.result()
+        return chunks
+
+    def generate_missing(self, missing, chunks):
+        """Generate chunks as one region, store them in the cache and in chunks, and hand them to the threads
+        waiting on them"""
+        cxs, cys = zip(*missing)
+        left, top = min(cxs), min(cys)
+        across, down = max(cxs) - left + 1, max(cys) - top + 1
+        region = generate_region(
+            self.world_seed,
+            left * chunk_size,
+            top * chunk_size,
+            across * chunk_size,
+            down * chunk_size,
+            self.config,
+        )
+        for cx, cy in missing:
+            chunks[cx, cy] = region[
+                (cy - top) * chunk_size : (cy - top + 1) * chunk_size,
+                (cx - left) * chunk_size : (cx - left + 1) * chunk_size,
+            ].copy()
+        with self.lock:
+            futures = []
+            for key in missing:
+                self.chunks.put(key, chunks[key])
+                futures.append(self.building.pop(("chunks", key)))
+        for key, future in zip(missing, futures):
+            future.set_result(chunks[key])
+
+
+def majority_downsample(terrain_map):
+    """Halve a terrain code array with an even width and height, every 2x2 block becoming the code most of its
+    tiles have. Ties go to the higher code, so swamps and nests hold out against sand.
+    """
+    height, width = terrain_map.shape
+    blocks = (
+        terrain_map.reshape(height // 2, 2, width // 2, 2)
+        .transpose(0, 2, 1, 3)
+        .reshape(height // 2, width // 2, 4)
+    )
+    codes = np.arange(len(Terrain), dtype=np.uint8)
+    votes = (blocks[..., np.newaxis] == codes).sum(axis=2)
+    return (len(Terrain) - 1 - np.argmax(votes[..., ::-1], axis=2)).astype(np.uint8)
+
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    """Answers GET /{level}/{x}/{y}.png from the TilePyramid of the server"""
+
+    def do_GET(self):
+        match = tile_path.fullmatch(self.path)
+        if match is None:
+            self.send_error(404)
+            return
+        level, x, y = (int(group) for group in match.groups())
+        try:
+            image = self.server.pyramid.image(level, x, y)
+        except ValueError as error:
+            self.send_error(404, str(error))
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(image)))
+        # A tile never changes for the same seed and config
+        self.send_header("Cache-Control", "max-age=86400")
+        self.end_headers()
+        self.wfile.write(image)
+
+
+def make_server(pyramid, host="127.0.0.1", port=8000):
+    """An HTTP server for the tiles of a TilePyramid, answering each request on its own thread"""
+    server = ThreadingHTTPServer((host, port), TileRequestHandler)
+    server.pyramid = pyramid
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--levels", type=int, default=max_level)
+    parser.add_argument("--max-chunks", type=int, default=2048)
+    parser.add_argument("--max-tiles", type=int, default=1024)
+    args = parser.parse_args()
+
+    pyramid = TilePyramid(
+        args.seed,
+        levels=args.levels,
+        max_chunks=args.max_chunks,
+        max_tiles=args.max_tiles,
+    )
+    server = make_server(pyramid, args.host, args.port)
+    print(
+        f"Serving tiles on http://{args.host}:{server.server_port}/{{level}}/{{x}}/{{y}}.png"
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
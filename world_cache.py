@@ -0,0 +1,151 @@
+"""On-disk cache of generated worlds and their images, keyed by everything that decides a world.
+
+A world is fully decided by its seed, size, config and the generator version, so those are hashed into the file
+name of its entry. The terrain grid is kept as a compressed .npz file and the rendered image as a .png next to it.
+The least recently used files are evicted once the cache grows past its size budget.
+"""
+
+import contextlib
+import hashlib
+import os
+import random
+import tempfile
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+from map_generator import (
+    default_config,
+    generate_image,
+    generate_world,
+    generator_version,
+)
+
+cache_max_bytes = 512 * 2**20  # default size budget of a WorldCache
+partial_prefix = ".partial-"  # start of the names of entries still being written, which are not counted
+
+
+@dataclass
+class CacheStats:
+    """Counts of what a WorldCache did since it was opened"""
+
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    evictions: int = 0
+
+
+class WorldCache:
+    """Worlds and images by seed, size and config, generated on a miss and evicted least recently used first"""
+
+    def __init__(self, directory, max_bytes=None):
+        self.directory = directory
+        self.max_bytes = cache_max_bytes if max_bytes is None else max_bytes
+        self.stats = CacheStats()
+        os.makedirs(directory, exist_ok=True)
+        # File name to size, least recently used first. Use is tracked by modification time, so the order carries
+        # over between processes sharing a directory
+        entries = []
+        for entry in os.scandir(directory):
+            if entry.name.startswith(partial_prefix):
+                continue
+            if entry.is_file() & entry.name.endswith((".npz", ".png")):
+                info = entry.stat()
+                entries.append((info.st_mtime_ns, entry.name, info.st_size))
+        self.entries = OrderedDict((name, size) for _, name, size in sorted(entries))
+        self.total_bytes = sum(self.entries.values())
+
+    def world(self, seed, width=100, height=100, config=default_config):
+        """The uint8 terrain map generate_world gives for this size and config with a random.Random(seed)"""
+        name = entry_key(seed, width, height, config) + ".npz"
+        path = self.lookup(name)
+        if path is not None:
+            with np.load(path) as archive:
+                return archive["terrain_map"]
+        terrain_map = generate_world(
+            width, height, config=config, rng=random.Random(seed)
+        )
+        self.write(
+            name, lambda path: np.savez_compressed(path, terrain_map=terrain_map)
+        )
+        return terrain_map
+
+    def image(self, seed, width=100, height=100, config=default_config, scale=1):
+        """The PNG bytes of generate_image for the world of world(), at scale pixels per tile"""
+        name = f"{entry_key(seed, width, height, config)}-{scale}.png"
+        path = self.lookup(name)
+        if path is None:
+            terrain_map = self.world(seed, width, height, config)
+            path = self.write(
+                name, lambda path: generate_image(terrain_map, path, scale)
+            )
+        with open(path, "rb") as file:
+            return file.read()
+
+    def lookup(self, name):
+        """Path of an entry, marked as just used, or None on a miss"""
+        path = os.path.join(self.directory, name)
+        try:
+            os.utime(path)
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            self.total_bytes -= self.entries.pop(name, 0)
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        # Entries written by another process sharing the directory are picked up here
+        self.total_bytes += size - self.entries.pop(name, 0)
+        self.entries[name] = size
+        return path
+
+    def write(self, name, save):
+        """Store an entry written by save(path) and return its path, evicting down to the size budget"""
+        # Save to a temporary file first, so readers never see half an entry. It keeps the extension, which save
+        # may go by
+        handle, temporary = tempfile.mkstemp(
+            suffix=os.path.splitext(name)[1], prefix=partial_prefix, dir=self.directory
+        )
+        os.close(handle)
+        try:
+            save(temporary)
+            os.replace(temporary, os.path.join(self.directory, name))
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary)
+            raise
+        path = os.path.join(self.directory, name)
+        size = os.path.getsize(path)
+        self.total_bytes += size - self.entries.pop(name, 0)
+        self.entries[name] = size
+        self.stats.writes += 1
+        self.evict(keep=name)
+        return path
+
+    def evict(self, keep=None):
+        """Remove least recently used entries until the cache fits its size budget. The keep entry, just written,
+        stays even if it alone is over budget."""
+        for name in list(self.entries):
+            if (self.total_bytes <= self.max_bytes) | (name == keep):
+                break
+            self.remove(name)
+            self.stats.evictions += 1
+
+    def clear(self):
+        """Remove every entry"""
+        for name in list(self.entries):
+            self.remove(name)
+
+    def remove(self, name):
+        """Delete an entry"""
+        self.total_bytes -= self.entries.pop(name)
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def entry_key(seed, width, height, config):
+    """File name stem of the cache entry of a world"""
+    key = f"{generator_version}:{seed}:{width}x{height}:{config.stable_hash()}"
+    return hashlib.sha256(key.encode()).hexdigest()
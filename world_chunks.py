@@ -0,0 +1,340 @@
+"""Chunked generation of an unbounded Corrinthea world.
+
+generate_world lays a whole map out in one pass that checks each feature against those placed before it in scan
+order, so any tile depends on everything before it. Here the draws come from a CounterRandom of the world seed, so
+they are tied to world positions, and every stage only looks a bounded distance around a tile. Any chunk can then be generated on its own, from a window grown by
+those distances, and neighbouring chunks agree along their seams.
+
+The stages follow the rules of map_generator, with the parts that depended on the scan order made local: cores give
+way to nearby candidates that rolled lower, BC nests compete with the candidates before them in their row and column,
+SC nests look at the map as the BC stage left it, and every BC nest starves on the final counts.
+"""
+
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from map_generator import (
+    HOLE_CORE,
+    HOLE_SIDE,
+    NEST_BC,
+    NEST_SC,
+    NEST_STARVED_BC,
+    NEST_SWAMP_SC,
+    SAND,
+    SWAMP,
+    CounterRandom,
+    SpatialHash,
+    bc_directions,
+    bc_extra_draws,
+    default_config,
+    cross_totals,
+    keys_in_ranges,
+    manhattan_distances,
+    sinkhole_arms,
+    sinkhole_stencil,
+    sinkhole_terrain,
+    stage_bc_nests,
+    stage_cores,
+    stage_sc_nests,
+    stage_sinkhole_arms,
+    stage_swamps,
+    swamp_size_bonus,
+    swamp_walks,
+)
+
+chunk_size = 128  # tiles along each side of a chunk. Also stands in for the map size in the swamp size bonus
+parallel_tile_size = 512  # tiles along each side of the pieces generate_region_parallel hands out. Each piece also
+# generates its halo, so smaller pieces spread better over workers but repeat more work
+
+
+class Window(namedtuple("Window", "x y width height")):
+    """A rectangle of world tiles, x and y being its top left corner"""
+
+    __slots__ = ()
+
+    def grown(self, margin):
+        """This window with margin extra tiles on every side"""
+        return Window(
+            self.x - margin,
+            self.y - margin,
+            self.width + 2 * margin,
+            self.height + 2 * margin,
+        )
+
+
+def generate_chunk(world_seed, cx, cy, config=default_config):
+    """Generate chunk cx, cy of the world as a chunk_size square uint8 array of Terrain codes"""
+    return generate_region(
+        world_seed, cx * chunk_size, cy * chunk_size, chunk_size, chunk_size, config
+    )
+
+
+def generate_region(world_seed, x, y, width, height, config=default_config):
+    """Generate the world tiles from x, y to x + width - 1, y + height - 1 as a uint8 array of Terrain codes.
+    Tiles come out the same whichever region they are generated as part of."""
+    margins = stage_margins(config)
+    halo = sum(margins)
+    window = Window(x, y, width, height).grown(halo)
+    terrain_map = np.full((window.height, window.width), SAND, dtype=np.uint8)
+    # Each stage works on the whole window, but is only right for tiles at least its margin inside the part the
+    # stage before got right. The halo covers all margins, so the requested tiles are right at the end.
+    create_local_sinkholes(terrain_map, world_seed, window, config)
+    create_local_swamps(terrain_map, world_seed, window, config)
+    create_local_bc_nests(terrain_map, world_seed, window, config)
+    create_local_sc_nests(terrain_map, world_seed, window, config)
+    starve_local_nests(terrain_map, config)
+    return terrain_map[halo : halo + height, halo : halo + width].copy()
+
+
+def generate_region_parallel(
+    world_seed, x, y, width, height, workers=None, tile_size=None, config=default_config
+):
+    """generate_region, split into square pieces that a pool of worker processes generate into a shared grid. Each
+    piece is generated with its own halo, so the result is the same for any number of workers.
+    """
+    if tile_size is None:
+        tile_size = parallel_tile_size
+    pieces = [
+        Window(
+            x + left,
+            y + top,
+            min(tile_size, width - left),
+            min(tile_size, height - top),
+        )
+        for top in range(0, height, tile_size)
+        for left in range(0, width, tile_size)
+    ]
+    grid_memory = shared_memory.SharedMemory(create=True, size=max(width * height, 1))
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            tasks = [
+                (world_seed, grid_memory.name, x, y, width, height, piece, config)
+                for piece in pieces
+            ]
+            list(pool.map(generate_piece, tasks))
+        terrain_map = np.ndarray(
+            (height, width), dtype=np.uint8, buffer=grid_memory.buf
+        ).copy()
+    finally:
+        grid_memory.close()
+        grid_memory.unlink()
+    return terrain_map
+
+
+def generate_piece(task):
+    """Worker side of generate_region_parallel: generate one piece into the shared grid"""
+    world_seed, grid_name, x, y, width, height, piece, config = task
+    grid_memory = shared_memory.SharedMemory(name=grid_name)
+    try:
+        grid = np.ndarray((height, width), dtype=np.uint8, buffer=grid_memory.buf)
+        grid[
+            piece.y - y : piece.y - y + piece.height,
+            piece.x - x : piece.x - x + piece.width,
+        ] = generate_region(world_seed, *piece, config)
+        del grid
+    finally:
+        grid_memory.close()
+    return piece
+
+
+def stage_margins(config=default_config):
+    """How far around a tile each stage reads the map, in stage order"""
+    core_spacing = config.sinkhole_min_dist + config.sinkhole_avg_size
+    # No arm is longer than sinkhole_avg_size, and the pointy offset adds one
+    hole_reach = max(config.sinkhole_avg_size, 0) + 1
+    # A spiral loop moves at most two arm lengths in any direction, the leftward arm taking an extra step per tile.
+    # The bonus one band short of the largest is 8 whatever swamp_max_bonus is
+    walk_loops = config.swamp_max_size * max(config.swamp_max_bonus, 8)
+    walk_reach = (walk_loops + 1) * 2 * config.swamp_max_arm
+    # Further from a sinkhole than a fifth of the map size, the swamp size bonus is maxed out
+    swamp_sight = 2 * chunk_size // 5 + 1
+    bc_reach = (
+        max(config.bc_check_radius, 0)
+        + config.bc_nest_max_dist
+        + config.bc_max_nest_size
+    )
+    sc_reach = max(
+        config.sc_check_radius,
+        config.sc_nest_max_hole_dist + 1,
+        config.sc_nest_max_swamp_dist + 1,
+    )
+    return (
+        core_spacing + hole_reach,
+        walk_reach + swamp_sight,
+        bc_reach,
+        sc_reach,
+        max(config.bc_starve_range, 0),
+    )
+
+
+def chance_of_roll(spread, hit):
+    """Chance that random.randint(0, spread) comes up as hit"""
+    if (hit < 0) | (hit > spread):
+        return 0
+    return 1 / (spread + 1)
+
+
+def create_local_sinkholes(terrain_map, world_seed, window, config=default_config):
+    """Place cores where a roll comes up and no candidate within the core spacing rolled lower, then stamp their sides"""
+    height, width = terrain_map.shape
+    core_spacing = config.sinkhole_min_dist + config.sinkhole_avg_size
+    source = CounterRandom(world_seed)
+    roll = source.window(stage_cores, *window)
+    ys, xs = np.nonzero(roll < chance_of_roll(1000 - config.sinkhole_density, 0))
+    candidates = SpatialHash(core_spacing)
+    for x, y in zip(xs.tolist(), ys.tolist()):
+        candidates.add(x, y)
+    cores = [
+        (x, y)
+        for x, y in zip(xs.tolist(), ys.tolist())
+        if all(
+            (roll[y, x], y, x) <= (roll[other_y, other_x], other_y, other_x)
+            for other_x, other_y in candidates.points_within(x, y, core_spacing)
+        )
+    ]
+
+    for x, y in cores:
+        rng = source.tile_random(stage_sinkhole_arms, window.x + x, window.y + y)
+        reach, vertical, horizontal, footprint = sinkhole_stencil(
+            *sinkhole_arms(rng, config)
+        )
+        top = max(y - reach, 0)
+        left = max(x - reach, 0)
+        bottom = min(y + reach + 1, height)
+        right = min(x + reach + 1, width)
+        mask = footprint[
+            top - y + reach : bottom - y + reach, left - x + reach : right - x + reach
+        ]
+        terrain_map[top:bottom, left:right][mask] = HOLE_SIDE
+    for x, y in cores:
+        terrain_map[y, x] = HOLE_CORE
+    return terrain_map
+
+
+def create_local_swamps(terrain_map, world_seed, window, config=default_config):
+    """Walk a swamp spiral from every seed that comes up away from sinkholes, then fill the sand it passed over"""
+    height, width = terrain_map.shape
+    holes = np.isin(terrain_map, sinkhole_terrain)
+    hole_adjacent = grown_mask(holes)
+    hole_dist = manhattan_distances(holes)
+    source = CounterRandom(world_seed)
+    roll = source.window(stage_swamps, *window)
+    seeds = (
+        (roll < chance_of_roll(1000 - config.swamp_density, 2))
+        & (terrain_map == SAND)
+        & ~hole_adjacent
+    )
+
+    ys, xs = np.nonzero(seeds)
+    dist_bonus = np.array(
+        [
+            swamp_size_bonus(2 * chunk_size, dist, config)
+            for dist in hole_dist[ys, xs].tolist()
+        ],
+        dtype=np.int64,
+    )
+    # Spirals are drawn by their world position, then walked over in window tiles
+    walk_seed, walk_xs, walk_ys = swamp_walks(
+        source, xs + window.x, ys + window.y, dist_bonus, config
+    )
+    walk_xs, walk_ys = walk_xs - window.x, walk_ys - window.y
+    inside = (walk_xs >= 0) & (walk_xs < width) & (walk_ys >= 0) & (walk_ys < height)
+    walked = seeds.copy()
+    walked[walk_ys[inside], walk_xs[inside]] = True
+    terrain_map[walked & (terrain_map == SAND) & ~hole_adjacent] = SWAMP
+    return terrain_map
+
+
+def create_local_bc_nests(terrain_map, world_seed, window, config=default_config):
+    """Spawn BC nests near sinkholes, each counting the candidates before it in its row and column as competition"""
+    height, width = terrain_map.shape
+    holes = np.isin(terrain_map, sinkhole_terrain)
+    hole_dist = manhattan_distances(holes)
+    source = CounterRandom(world_seed)
+    roll = source.window(stage_bc_nests, *window)
+    ys, xs = np.nonzero(
+        (roll < chance_of_roll(10 - config.bc_nest_density, 1))
+        & (hole_dist <= config.bc_nest_max_dist)
+    )
+    if config.bc_check_radius <= 0:
+        return terrain_map
+    reach = config.bc_check_radius - 1
+    hole_tile_total = cross_totals(holes, ys, xs, reach)
+    # Candidates to the left in the row and above in the column, within the check radius
+    row_keys = ys * width + xs
+    column_keys = xs * height + ys
+    bc_tile_total = keys_in_ranges(
+        row_keys, row_keys - np.minimum(xs, reach), row_keys - 1
+    ) + keys_in_ranges(
+        np.sort(column_keys), column_keys - np.minimum(ys, reach), column_keys - 1
+    )
+    surplus = hole_tile_total - bc_tile_total * config.bc_load
+
+    nests = np.zeros_like(holes)
+    extra_rolls, extra_directions = bc_extra_draws(
+        source, xs + window.x, ys + window.y, config
+    )
+    for nest, (y, x, tiles) in enumerate(
+        zip(ys.tolist(), xs.tolist(), surplus.tolist())
+    ):
+        for b in range(min(tiles, config.bc_max_nest_size)):
+            if extra_rolls[nest][b] == 0:
+                step_x, step_y = bc_directions[extra_directions[nest][b]]
+                xNew = x + step_x * b
+                yNew = y + step_y * b
+                if (xNew >= 0) & (xNew < width) & (yNew >= 0) & (yNew < height):
+                    if (terrain_map[yNew, xNew] == SAND) & (
+                        hole_dist[yNew, xNew] < config.bc_nest_max_dist
+                    ):
+                        nests[yNew, xNew] = True
+    terrain_map[nests] = NEST_BC
+    return terrain_map
+
+
+def create_local_sc_nests(terrain_map, world_seed, window, config=default_config):
+    """Spawn SC nests near swamps and sinkholes, closer to swamps than to BC nests and with sinkholes outnumbering BCs"""
+    holes = np.isin(terrain_map, sinkhole_terrain)
+    bc_nests = terrain_map == NEST_BC
+    swamp_dist = manhattan_distances(terrain_map == SWAMP)
+    roll = CounterRandom(world_seed).window(stage_sc_nests, *window)
+    ys, xs = np.nonzero(
+        (roll < chance_of_roll(10 - config.sc_nest_density, 1))
+        & (manhattan_distances(holes) <= config.sc_nest_max_hole_dist)
+        & (swamp_dist <= config.sc_nest_max_swamp_dist)
+        & (swamp_dist < manhattan_distances(bc_nests))
+    )
+    if config.sc_check_radius <= 0:
+        return terrain_map
+    reach = config.sc_check_radius - 1
+    spawn = cross_totals(holes, ys, xs, reach) > cross_totals(bc_nests, ys, xs, reach)
+    ys, xs = ys[spawn], xs[spawn]
+    # Spawn as special tile if it happens to be on top of a swamp
+    terrain_map[ys, xs] = np.where(terrain_map[ys, xs] == SWAMP, NEST_SWAMP_SC, NEST_SC)
+    return terrain_map
+
+
+def starve_local_nests(terrain_map, config=default_config):
+    """Starve every BC nest with more BC tiles than its SC tiles can feed in range, all counted on the same map"""
+    if config.bc_starve_range <= 0:
+        return terrain_map
+    reach = config.bc_starve_range - 1
+    ys, xs = np.nonzero(terrain_map == NEST_BC)
+    bc_tile_total = cross_totals(terrain_map == NEST_BC, ys, xs, reach)
+    sc_tile_total = cross_totals(terrain_map == NEST_SC, ys, xs, reach)
+    starved = bc_tile_total > sc_tile_total * config.sc_feed_multiplier
+    terrain_map[ys[starved], xs[starved]] = NEST_STARVED_BC
+    return terrain_map
+
+
+def grown_mask(mask):
+    """The mask with every True tile spread to its eight neighbours"""
+    height, width = mask.shape
+    padded = np.pad(mask, 1)
+    grown = np.zeros_like(mask)
+    for dy in range(3):
+        for dx in range(3):
+            grown |= padded[dy : dy + height, dx : dx + width]
+    return grown
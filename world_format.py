@@ -0,0 +1,270 @@
+"""Versioned binary world files, readable a region at a time.
+
+A world file holds a fixed header, JSON metadata (seed, config and its hash, terrain legend, where everything is),
+the entity lists, and the terrain grid. The grid is either raw uint8 rows, which open as a memory map, or square
+chunks compressed one by one, so that reading a region only inflates the chunks it overlaps. Sections start on
+64 byte boundaries.
+"""
+
+import contextlib
+import json
+import mmap
+import struct
+import zlib
+from dataclasses import asdict
+
+import numpy as np
+
+from map_generator import (
+    HOLE_CORE,
+    NEST_BC,
+    NEST_SC,
+    NEST_STARVED_BC,
+    NEST_SWAMP_SC,
+    Terrain,
+    default_config,
+    generator_version,
+)
+
+world_magic = b"CORRWRLD"
+world_format_version = 1
+header_format = "<8sHHIIIQ"  # magic, format version, compression, width, height, chunk size, metadata length
+section_alignment = 64
+
+compression_none = 0
+compression_zlib = 1
+
+# Terrain codes whose tiles are listed as entities, by entity name
+entity_terrain = {
+    "sinkhole_cores": (HOLE_CORE,),
+    "bc_nests": (NEST_BC,),
+    "starved_bc_nests": (NEST_STARVED_BC,),
+    "sc_nests": (NEST_SC, NEST_SWAMP_SC),
+}
+
+
+def world_entities(terrain_map):
+    """The x, y coordinates of the tiles of every entity_terrain class, as int32 arrays of shape (n, 2)"""
+    entities = {}
+    for name, codes in entity_terrain.items():
+        ys, xs = np.nonzero(np.isin(terrain_map, codes))
+        entities[name] = np.column_stack([xs, ys]).astype(np.int32)
+    return entities
+
+
+def save_world(
+    path,
+    terrain_map,
+    seed=None,
+    config=default_config,
+    entities=None,
+    compress=False,
+    chunk_size=256,
+):
+    """Write a terrain map to a world file, or to a binary file object opened for writing and seeking. entities maps
+    names to int32 arrays of rows, world_entities of the map by default. With compress set, the grid is stored as zlib
+    compressed chunk_size squares.
+    """
+    height, width = terrain_map.shape
+    if entities is None:
+        entities = world_entities(terrain_map)
+    entities = {name: entity_rows(rows) for name, rows in entities.items()}
+
+    # Lay the sections out first, so the metadata can say where everything is
+    offset = 0
+    entity_sections = {}
+    for name, rows in entities.items():
+        entity_sections[name] = {"offset": offset, "shape": list(rows.shape)}
+        offset = aligned(offset + rows.nbytes)
+    chunks = []
+    if compress:
+        for top in range(0, height, chunk_size):
+            for left in range(0, width, chunk_size):
+                chunk = terrain_map[top : top + chunk_size, left : left + chunk_size]
+                chunks.append(zlib.compress(np.ascontiguousarray(chunk).tobytes()))
+        chunk_offsets = np.cumsum(
+            [0] + [len(chunk) for chunk in chunks], dtype=np.uint64
+        )
+        grid_section = {"offset": offset, "chunk_table_length": len(chunk_offsets)}
+    else:
+        grid_section = {"offset": offset}
+    metadata = {
+        "seed": seed,
+        "config_hash": config.stable_hash(),
+        "config": asdict(config),
+        "generator_version": generator_version,
+        "legend": [terrain.name for terrain in Terrain],
+        "entities": entity_sections,
+        "grid": grid_section,
+    }
+    metadata_bytes = json.dumps(metadata, sort_keys=True).encode()
+    header = struct.pack(
+        header_format,
+        world_magic,
+        world_format_version,
+        compression_zlib if compress else compression_none,
+        width,
+        height,
+        chunk_size if compress else 0,
+        len(metadata_bytes),
+    )
+    # Section offsets in the metadata count from the end of it
+    body_start = aligned(len(header) + len(metadata_bytes))
+
+    if hasattr(path, "write"):
+        opened = contextlib.nullcontext(path)
+    else:
+        opened = open(path, "wb")
+    with opened as file:
+        file.write(header)
+        file.write(metadata_bytes)
+        for name, rows in entities.items():
+            file.seek(body_start + entity_sections[name]["offset"])
+            file.write(rows.tobytes())
+        file.seek(body_start + grid_section["offset"])
+        if compress:
+            file.write(chunk_offsets.tobytes())
+            for chunk in chunks:
+                file.write(chunk)
+        else:
+            file.write(np.ascontiguousarray(terrain_map, dtype=np.uint8).tobytes())
+        file.truncate()
+
+
+def entity_rows(rows):
+    """An entity list as a contiguous int32 array with a row per entity. The columns of an empty list are kept, and a
+    flat list is one column."""
+    rows = np.ascontiguousarray(rows, dtype=np.int32)
+    if rows.ndim == 1:
+        return rows.reshape(-1, 1)
+    return rows.reshape(len(rows), int(np.prod(rows.shape[1:])))
+
+
+def aligned(offset):
+    """offset rounded up to the section alignment"""
+    return -(-offset // section_alignment) * section_alignment
+
+
+class WorldFile:
+    """A world file opened as a memory map. Only the metadata is read up front; the grid and entities are read
+    from the map as they are used."""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        header_size = struct.calcsize(header_format)
+        (
+            magic,
+            version,
+            self.compression,
+            self.width,
+            self.height,
+            self.chunk_size,
+            metadata_length,
+        ) = struct.unpack_from(header_format, self.map)
+        if magic != world_magic:
+            raise ValueError(f"{path} is not a world file")
+        if version > world_format_version:
+            raise ValueError(
+                f"{path} has world format version {version}, newer than {world_format_version}"
+            )
+        self.metadata = json.loads(
+            self.map[header_size : header_size + metadata_length]
+        )
+        self.body_start = aligned(header_size + metadata_length)
+        self.seed = self.metadata["seed"]
+        self.config_hash = self.metadata["config_hash"]
+        self.legend = self.metadata["legend"]
+
+        grid_start = self.body_start + self.metadata["grid"]["offset"]
+        if self.compression == compression_none:
+            self.grid = np.ndarray(
+                (self.height, self.width),
+                dtype=np.uint8,
+                buffer=self.map,
+                offset=grid_start,
+            )
+        else:
+            self.grid = None
+            table_length = self.metadata["grid"]["chunk_table_length"]
+            self.chunk_offsets = np.frombuffer(
+                self.map, dtype=np.uint64, count=table_length, offset=grid_start
+            )
+            self.chunks_start = grid_start + 8 * table_length
+            self.chunks_across = -(-self.width // self.chunk_size)
+
+    def entity(self, name):
+        """The rows of an entity list, read into an int32 array of shape (n, columns)"""
+        section = self.metadata["entities"][name]
+        rows, columns = section["shape"]
+        return np.ndarray(
+            (rows, columns),
+            dtype=np.int32,
+            buffer=self.map,
+            offset=self.body_start + section["offset"],
+        ).copy()
+
+    @property
+    def entity_names(self):
+        """Names of the stored entity lists"""
+        return list(self.metadata["entities"])
+
+    def region(self, x, y, width, height):
+        """The terrain codes from x, y to x + width - 1, y + height - 1, clipped to the world, as a new array"""
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + width, self.width), min(y + height, self.height)
+        if (right <= left) | (bottom <= top):
+            return np.zeros((0, 0), dtype=np.uint8)
+        if self.grid is not None:
+            return self.grid[top:bottom, left:right].copy()
+
+        region = np.empty((bottom - top, right - left), dtype=np.uint8)
+        size = self.chunk_size
+        for cy in range(top // size, (bottom - 1) // size + 1):
+            for cx in range(left // size, (right - 1) // size + 1):
+                chunk = self.chunk(cx, cy)
+                rows = slice(max(top, cy * size), min(bottom, (cy + 1) * size))
+                columns = slice(max(left, cx * size), min(right, (cx + 1) * size))
+                region[
+                    rows.start - top : rows.stop - top,
+                    columns.start - left : columns.stop - left,
+                ] = chunk[
+                    rows.start - cy * size : rows.stop - cy * size,
+                    columns.start - cx * size : columns.stop - cx * size,
+                ]
+        return region
+
+    def chunk(self, cx, cy):
+        """Inflate one compressed chunk"""
+        index = cy * self.chunks_across + cx
+        start = self.chunks_start + int(self.chunk_offsets[index])
+        stop = self.chunks_start + int(self.chunk_offsets[index + 1])
+        size = self.chunk_size
+        shape = (
+            min(size, self.height - cy * size),
+            min(size, self.width - cx * size),
+        )
+        return np.frombuffer(
+            zlib.decompress(self.map[start:stop]), dtype=np.uint8
+        ).reshape(shape)
+
+    def terrain_map(self):
+        """The whole grid, read into memory"""
+        return self.region(0, 0, self.width, self.height)
+
+    def close(self):
+        """Unmap the file. Views of grid must be gone by then."""
+        self.grid = None
+        self.chunk_offsets = None
+        self.map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_world(path):
+    """Open a world file written by save_world"""
+    return WorldFile(path)